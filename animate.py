@@ -0,0 +1,191 @@
+"""Animate terrain through time, using time as a third noise coordinate.
+
+Features grow, shrink and drift from frame to frame (clouds, tides, shifting
+dunes) instead of being revealed pixel by pixel. Frames are rendered as
+(t, h, w) batches across a process pool, colored through the terrain palette
+and streamed in order into a lib.VideoEncoder.
+"""
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+import lib
+
+# Noise distance travelled along the time axis per frame
+TIME_STEP = 0.02
+# Frames rendered by one pool task
+FRAME_BATCH = 4
+
+
+def animation_size(width, height):
+    """Frame size (width, height) to render a map's animation at.
+
+    Maps wider than their video are sampled at the video size directly, the
+    noise being continuous; smaller maps keep their size and are upscaled to
+    whole pixel blocks when encoded.
+    """
+    video_w, video_h = lib.video_size(width, height)
+    if video_w < width:
+        return video_w, video_h
+    return width, height
+
+
+def _color_frames(times, x, y, octaves, persistence, lacunarity, seed, value_range, lut):
+    """Colored (len(times), h, w, 3) frames, normalized with a fixed range so they do not flicker."""
+    raw = lib.noise_frames(x, y, times, octaves=octaves, persistence=persistence,
+                           lacunarity=lacunarity, seed=seed)
+    return lut[lib.quantize_map(lib.normalize_range(raw, value_range))]
+
+
+def _render_frames(slot_name, shape, times, *params):
+    """Process pool task: render a batch of colored frames into a shared slot."""
+    shm = shared_memory.SharedMemory(name=slot_name)
+    try:
+        out = np.ndarray(shape, dtype=np.uint8, buffer=shm.buf)
+        out[:len(times)] = _color_frames(times, *params)
+        del out
+    finally:
+        shm.close()
+
+
+def animation_frames(width, height, frame_count, scale=100.0, octaves=6, persistence=0.5, lacunarity=2.0,
+                     seed=0, time_step=TIME_STEP, variation=255, terrains=None,
+                     value_range=lib.WORLD_VALUE_RANGE, workers=None, batch_frames=FRAME_BATCH,
+                     window=None, cancel=None):
+    """Yield frame_count colored (height, width, 3) uint8 frames in order.
+
+    Frame t samples the map at time t * time_step. Batches of batch_frames
+    frames are rendered by the pool into shared-memory slots while earlier
+    ones are consumed; at most `window` frames (2 * workers * batch_frames
+    by default) are rendered ahead, so memory does not grow with the number
+    of frames. Every frame is normalized with the fixed value_range, as in
+    generate_region, so colors stay put over time.
+
+    cancel is an optional callable polled between frames; once it returns
+    True, Cancelled is raised.
+    """
+    if terrains is None:
+        terrains = lib.DEFAULT_TERRAINS
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if window is None:
+        window = 2 * workers * batch_frames
+
+    x, y = lib.noise_coords(width, height, scale)
+    times = np.arange(frame_count) * time_step
+    batches = [times[start:start + batch_frames] for start in range(0, frame_count, batch_frames)]
+    params = (x, y, octaves, persistence, lacunarity, seed, value_range, lib.palette_lut(variation, terrains))
+
+    if workers <= 1:
+        for batch in batches:
+            for frame in _color_frames(batch, *params):
+                lib.check_cancel(cancel)
+                yield frame
+        return
+
+    shape = (batch_frames, height, width, 3)
+    slots = [shared_memory.SharedMemory(create=True, size=int(np.prod(shape)))
+             for _ in range(min(len(batches), max(1, window // batch_frames)))]
+    free = list(range(len(slots)))
+    pending = deque()
+
+    try:
+        with ProcessPoolExecutor(max_workers=min(workers, len(slots))) as pool:
+            queued = iter(batches)
+
+            def submit():
+                batch = next(queued, None)
+                if batch is None:
+                    return
+                slot = free.pop()
+                pending.append((pool.submit(_render_frames, slots[slot].name, shape, batch, *params),
+                                slot, len(batch)))
+
+            for _ in range(len(slots)):
+                submit()
+
+            # Batches finish in any order but are consumed in submission order
+            while pending:
+                task, slot, count = pending.popleft()
+                lib._wait_tasks([task], cancel)
+
+                # Copied out so no view of the slot outlives it
+                shared = np.ndarray(shape, dtype=np.uint8, buffer=slots[slot].buf)
+                frames = shared[:count].copy()
+                del shared
+
+                free.append(slot)
+                submit()
+
+                for frame in frames:
+                    lib.check_cancel(cancel)
+                    yield frame
+    finally:
+        for task, _, _ in pending:
+            task.cancel()
+        for shm in slots:
+            shm.close()
+            shm.unlink()
+
+
+def render_animation(filename, width, height, frame_count, fps=30, queue_size=32, progress=None,
+                     telemetry=None, cancel=None, **params):
+    """Encode an animation_frames video of a (width, height) map to filename.
+
+    Frames are rendered at animation_size(width, height) and scaled to
+    lib.video_size(width, height). params are passed to animation_frames.
+    progress, if given, is called with (done, total, stats) after every
+    frame. Returns the final stats: frames, seconds, frames_per_second and
+    encode_frames_per_second. With a telemetry.Telemetry, frame rendering
+    and encoding are recorded as the animate_frames and animate_encode
+    stages.
+    """
+    frame_w, frame_h = animation_size(width, height)
+    video_w, video_h = lib.video_size(width, height)
+    row_index = lib._nearest_index(frame_h, video_h)
+    col_index = lib._nearest_index(frame_w, video_w)
+    resize = (frame_w, frame_h) != (video_w, video_h)
+
+    stats = {"frames": 0, "seconds": 0.0, "frames_per_second": 0.0, "encode_frames_per_second": 0.0}
+    frames = animation_frames(frame_w, frame_h, frame_count, cancel=cancel, **params)
+    encoder = lib.VideoEncoder(filename, fps, queue_size=queue_size).start()
+    start = time.perf_counter()
+
+    # Frame rendering only, time spent waiting on the encoder queue is left out
+    synthesis = 0
+    try:
+        while True:
+            frame_start = time.perf_counter()
+            frame = next(frames, None)
+            if frame is not None and resize:
+                frame = frame[row_index][:, col_index]
+            synthesis += time.perf_counter() - frame_start
+            if frame is None:
+                break
+            encoder.append(frame)
+
+            elapsed = time.perf_counter() - start
+            stats["frames"] += 1
+            stats["seconds"] = elapsed
+            stats["frames_per_second"] = stats["frames"] / elapsed
+            stats["encode_frames_per_second"] = encoder.frames_per_second
+            if progress is not None:
+                progress(stats["frames"], frame_count, stats)
+    except BaseException:
+        frames.close()
+        encoder.close(discard=True)
+        raise
+    encoder.close()
+
+    stats["seconds"] = time.perf_counter() - start
+    stats["frames_per_second"] = stats["frames"] / stats["seconds"] if stats["seconds"] > 0 else 0.0
+    stats["encode_frames_per_second"] = encoder.frames_per_second
+
+    if telemetry is not None:
+        telemetry.add("animate_frames", synthesis, pixels=frame_count * frame_w * frame_h)
+        telemetry.add("animate_encode", encoder.encode_time, pixels=encoder.frames * video_w * video_h)
+    return stats
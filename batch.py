@@ -0,0 +1,126 @@
+"""Render many maps (seed sweeps, parameter sets) across a process pool."""
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from multiprocessing import shared_memory
+
+import numpy as np
+
+import lib
+
+
+def seed_jobs(seeds, width, height, **params):
+    """One job per seed with otherwise identical generate_noise_map parameters."""
+    return [dict(params, width=width, height=height, seed=seed) for seed in seeds]
+
+
+def parse_seeds(text):
+    """Seeds from a string like "1-10,42,100-105"."""
+    seeds = []
+    for part in text.split(","):
+        part = part.strip()
+        if "-" in part[1:]:
+            start, end = part.split("-", 1)
+            seeds.extend(range(int(start), int(end) + 1))
+        elif part:
+            seeds.append(int(part))
+    return seeds
+
+
+def output_paths(jobs, output):
+    """output.format(**job) for every job, ValueError unless they all differ."""
+    paths = [output.format(**job) for job in jobs]
+    if len(set(paths)) < len(paths):
+        raise ValueError(f"Output {output!r} does not name a different file for every map, "
+                         "use a pattern such as map_{seed}.png")
+    return paths
+
+
+def _render_job(slot_name, job, variation, terrains):
+    """Process pool task: render one colored map into a shared slot."""
+    shape = (job["height"], job["width"], 3)
+    shm = shared_memory.SharedMemory(name=slot_name)
+    try:
+        out = np.ndarray(shape, dtype=np.uint8, buffer=shm.buf)
+        nmap = lib.generate_noise_map(**job)
+        out[:] = lib.colorize(nmap, variation=variation, terrains=terrains)
+        del out
+    finally:
+        shm.close()
+
+
+def render_batch(jobs, output, variation=255, terrains=None, workers=None, progress=None):
+    """Render every job and write it to output.format(**job) as it finishes.
+
+    output must give every job its own file (ValueError otherwise).
+
+    jobs are dicts of generate_noise_map arguments, e.g. from seed_jobs.
+    Results come back through 2 * workers preallocated shared-memory slots
+    that are reused for the whole batch, so memory does not grow with the
+    number of jobs. progress, if given, is called with (done, total, stats)
+    after every map. Returns the final stats: maps, megapixels, seconds,
+    maps_per_second and megapixels_per_second.
+    """
+    if terrains is None:
+        terrains = lib.DEFAULT_TERRAINS
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    jobs = list(jobs)
+    total = len(jobs)
+    paths = output_paths(jobs, output)
+    stats = {"maps": 0, "megapixels": 0.0, "seconds": 0.0,
+             "maps_per_second": 0.0, "megapixels_per_second": 0.0}
+    if not jobs:
+        return stats
+
+    slot_size = max(job["width"] * job["height"] * 3 for job in jobs)
+    slots = [shared_memory.SharedMemory(create=True, size=slot_size)
+             for _ in range(min(total, workers * 2))]
+    free = list(range(len(slots)))
+    start = time.perf_counter()
+
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            pending = {}
+            queued = iter(zip(jobs, paths))
+
+            def submit():
+                job, path = next(queued, (None, None))
+                if job is None:
+                    return
+                slot = free.pop()
+                task = pool.submit(_render_job, slots[slot].name, job, variation, terrains)
+                pending[task] = (slot, job, path)
+
+            for _ in range(len(slots)):
+                submit()
+
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for task in done:
+                    slot, job, path = pending.pop(task)
+                    task.result()
+
+                    shape = (job["height"], job["width"], 3)
+                    colors = np.ndarray(shape, dtype=np.uint8, buffer=slots[slot].buf)
+                    lib.save_array(colors, path)
+                    del colors
+
+                    free.append(slot)
+                    submit()
+
+                    elapsed = time.perf_counter() - start
+                    stats["maps"] += 1
+                    stats["megapixels"] += job["width"] * job["height"] / 1e6
+                    stats["seconds"] = elapsed
+                    stats["maps_per_second"] = stats["maps"] / elapsed
+                    stats["megapixels_per_second"] = stats["megapixels"] / elapsed
+                    if progress is not None:
+                        progress(stats["maps"], total, stats)
+    finally:
+        for shm in slots:
+            shm.close()
+            shm.unlink()
+
+    return stats
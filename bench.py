@@ -0,0 +1,180 @@
+"""Benchmark the generation pipeline per stage and track regressions.
+
+Every case (size, octaves) runs in a fresh interpreter so its peak RSS is
+its own. Results are written as JSON and can be compared with a baseline:
+
+    python bench.py --output bench.json
+    python bench.py --baseline bench.json --output new.json
+
+Runs headless, Qt is never imported.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+from telemetry import peak_rss_mb
+
+README_SIZES = [64, 128, 256, 512, 1024, 2048, 4096, 8192]
+DEFAULT_SIZES = [64, 128, 256, 512, 1024, 2048]
+DEFAULT_OCTAVES = [1, 8]
+VIDEO_FRAMES = 60
+REGRESSION_THRESHOLD = 0.25
+# Slowdowns smaller than this are timer noise
+MIN_REGRESSION_SECONDS = 0.005
+
+
+def run_case(size, octaves, repeat=1, video=False):
+    """Time every stage of one case in this process, best of repeat runs."""
+    import lib
+
+    stages = {}
+
+    def timed(name, function, *args, **kwargs):
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = function(*args, **kwargs)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        stages[name] = best
+        return result
+
+    with tempfile.TemporaryDirectory() as tmp:
+        nmap = timed("noise", lib.generate_noise_map, size, size, scale=1.75, octaves=octaves, seed=1)
+        levels = timed("quantize", lib.quantize_map, nmap)
+        colors = timed("colorize", lib.colorize, nmap, variation=255, terrains=lib.DEFAULT_TERRAINS)
+        # Written the way the GUI and the CLI do, with the banded encoder
+        timed("noise_png", lib.save_outputs, [(levels, os.path.join(tmp, "noise.png"))])
+        timed("output_png", lib.save_outputs, [(colors, os.path.join(tmp, "output.png"))])
+
+        video_size = lib.video_size(size, size)
+        timed("video_frames", lambda: [None for _ in lib.reveal_frames([levels, colors], VIDEO_FRAMES, video_size)])
+
+        if video:
+            def encode():
+                encoder = lib.VideoEncoder(os.path.join(tmp, "output.mp4"), 30).start()
+                for frame in lib.reveal_frames([levels, colors], VIDEO_FRAMES, video_size):
+                    encoder.append(frame)
+                encoder.close()
+
+            timed("video_encode", encode)
+
+    return {
+        "size": size,
+        "octaves": octaves,
+        "stages": stages,
+        "total": sum(stages.values()),
+        "megapixels_per_second": size * size / 1e6 / sum(stages.values()),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def run_isolated(size, octaves, repeat, video):
+    """run_case in a child interpreter, for a per-case peak RSS."""
+    command = [sys.executable, os.path.abspath(__file__), "--case", str(size), str(octaves),
+               "--repeat", str(repeat)]
+    if video:
+        command.append("--video")
+
+    done = subprocess.run(command, capture_output=True, text=True, check=True,
+                          cwd=os.path.dirname(os.path.abspath(__file__)))
+    return json.loads(done.stdout)
+
+
+def case_key(case):
+    return (case["size"], case["octaves"])
+
+
+def compare(results, baseline, threshold=REGRESSION_THRESHOLD):
+    """Stages (and totals) slower than baseline by more than threshold."""
+    previous = {case_key(case): case for case in baseline["results"]}
+    regressions = []
+
+    for case in results["results"]:
+        old = previous.get(case_key(case))
+        if old is None:
+            continue
+
+        # Totals only over the stages both runs timed
+        shared = [stage for stage in case["stages"] if stage in old["stages"]]
+        timings = {stage: case["stages"][stage] for stage in shared}
+        old_timings = {stage: old["stages"][stage] for stage in shared}
+        timings["total"] = sum(timings.values())
+        old_timings["total"] = sum(old_timings.values())
+
+        for stage, seconds in timings.items():
+            old_seconds = old_timings[stage]
+            if seconds > old_seconds * (1 + threshold) and seconds - old_seconds > MIN_REGRESSION_SECONDS:
+                regressions.append({
+                    "size": case["size"],
+                    "octaves": case["octaves"],
+                    "stage": stage,
+                    "baseline": old_seconds,
+                    "seconds": seconds,
+                    "ratio": seconds / old_seconds,
+                })
+
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark terrain generation stages.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES,
+                        help="Square map sizes, README sizes go up to 8192")
+    parser.add_argument("--all-sizes", action="store_true", help="Every size of the README table")
+    parser.add_argument("--octaves", type=int, nargs="+", default=DEFAULT_OCTAVES)
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per stage, the best one is kept")
+    parser.add_argument("--video", action="store_true", help="Also time video encoding (needs imageio)")
+    parser.add_argument("--output", help="Write the results JSON here")
+    parser.add_argument("--baseline", help="Compare against this results JSON")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD,
+                        help="Allowed slowdown before a stage counts as a regression")
+    parser.add_argument("--case", type=int, nargs=2, metavar=("SIZE", "OCTAVES"), help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.case:
+        print(json.dumps(run_case(args.case[0], args.case[1], args.repeat, args.video)))
+        return 0
+
+    sizes = README_SIZES if args.all_sizes else args.sizes
+    results = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "results": [],
+    }
+
+    for size in sizes:
+        for octaves in args.octaves:
+            case = run_isolated(size, octaves, args.repeat, args.video)
+            results["results"].append(case)
+            stages = " ".join(f"{name}={seconds:.3f}s" for name, seconds in case["stages"].items())
+            rss = "n/a" if case["peak_rss_mb"] is None else f"{case['peak_rss_mb']:.0f} MB"
+            print(f"{size}x{size} octaves={octaves}: total={case['total']:.3f}s {stages} peak RSS={rss}",
+                  file=sys.stderr)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+        regressions = compare(results, baseline, args.threshold)
+        for r in regressions:
+            print(f"REGRESSION {r['size']}x{r['size']} octaves={r['octaves']} {r['stage']}: "
+                  f"{r['baseline']:.3f}s -> {r['seconds']:.3f}s ({r['ratio']:.2f}x)", file=sys.stderr)
+        if regressions:
+            return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,343 @@
+"""Content-addressed cache of normalized noise maps.
+
+Noise only depends on the size and noise parameters, so recoloring or
+re-rendering a map can reuse it instead of regenerating it.
+"""
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+import lib
+
+
+def noise_key(width, height, scale=100.0, octaves=6, persistence=0.5, lacunarity=2.0, seed=0):
+    """Hash of every parameter that changes the noise map."""
+    params = (int(width), int(height), float(scale), int(octaves),
+              float(persistence), float(lacunarity), int(seed))
+    return hashlib.sha1(repr(params).encode()).hexdigest()
+
+
+class NoiseCache:
+    """LRU of noise maps in memory with an optional on-disk .npy tier.
+
+    The memory tier keeps at most max_bytes of maps and evicts the least
+    recently used ones. With a directory, maps are also saved as .npy files
+    (up to max_disk_bytes, oldest access evicted first) and opened as
+    read-only memory maps on a memory miss. Cached arrays are read-only;
+    copy them before modifying.
+    """
+
+    def __init__(self, max_bytes=1 << 30, directory=None, max_disk_bytes=4 << 30,
+                 generator=lib.generate_noise_map):
+        self.max_bytes = max_bytes
+        self.generator = generator
+        self.directory = directory
+        self.max_disk_bytes = max_disk_bytes
+        self.maps = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.disk_evictions = 0
+        self.lock = threading.Lock()
+
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    def contains(self, key):
+        """Whether key is cached in memory or on disk, without counting a hit or loading it."""
+        with self.lock:
+            if key in self.maps:
+                return True
+            path = self._path(key)
+            return path is not None and os.path.exists(path)
+
+    def get(self, key):
+        """Cached map for key, or None."""
+        with self.lock:
+            if key in self.maps:
+                self.maps.move_to_end(key)
+                self.hits += 1
+                return self.maps[key]
+
+            path = self._path(key)
+            if path is not None and os.path.exists(path):
+                noise_map = np.load(path, mmap_mode="r")
+                os.utime(path)
+                self.disk_hits += 1
+                self._store(key, noise_map)
+                return noise_map
+
+            self.misses += 1
+            return None
+
+    def put(self, key, noise_map):
+        noise_map = np.asarray(noise_map)
+        noise_map.flags.writeable = False
+
+        with self.lock:
+            self._store(key, noise_map)
+
+            path = self._path(key)
+            if path is not None and not os.path.exists(path):
+                tmp = path + ".tmp.npy"
+                np.save(tmp, noise_map)
+                os.replace(tmp, path)
+                self._evict_disk()
+
+        return noise_map
+
+    def get_or_generate(self, width, height, scale=100.0, octaves=6, persistence=0.5, lacunarity=2.0,
+                        seed=0, **kwargs):
+        """Cached noise map, made by the generator (lib.generate_noise_map) on a miss.
+
+        Extra keyword arguments (workers, tile_size) only go to the generator.
+        """
+        key = noise_key(width, height, scale, octaves, persistence, lacunarity, seed)
+        noise_map = self.get(key)
+        if noise_map is None:
+            noise_map = self.generator(width, height, scale=scale, octaves=octaves,
+                                       persistence=persistence, lacunarity=lacunarity,
+                                       seed=seed, **kwargs)
+            noise_map = self.put(key, noise_map)
+        return noise_map
+
+    def clear(self):
+        with self.lock:
+            self.maps.clear()
+            self.bytes = 0
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "disk_evictions": self.disk_evictions,
+            "entries": len(self.maps),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+        }
+
+    def _path(self, key):
+        if self.directory is None:
+            return None
+        return os.path.join(self.directory, key + ".npy")
+
+    def _store(self, key, noise_map):
+        if key in self.maps:
+            self.bytes -= self.maps.pop(key).nbytes
+
+        # Maps bigger than the whole budget are only kept on disk
+        if noise_map.nbytes > self.max_bytes:
+            return
+
+        self.maps[key] = noise_map
+        self.bytes += noise_map.nbytes
+        while self.bytes > self.max_bytes:
+            _, evicted = self.maps.popitem(last=False)
+            self.bytes -= evicted.nbytes
+            self.evictions += 1
+
+    def _evict_disk(self):
+        files = []
+        for name in os.listdir(self.directory):
+            if name.endswith(".npy") and ".tmp" not in name:
+                path = os.path.join(self.directory, name)
+                stat = os.stat(path)
+                # get() touches files on every disk hit
+                files.append((stat.st_mtime, stat.st_size, path))
+
+        used = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if used <= self.max_disk_bytes:
+                break
+            os.remove(path)
+            used -= size
+            self.disk_evictions += 1
+
+
+def layers_key(width, height, scale=100.0, lacunarity=2.0, seed=0):
+    """Hash of the parameters octave layers depend on (not octaves or persistence)."""
+    params = (int(width), int(height), float(scale), float(lacunarity), int(seed))
+    return hashlib.sha1(repr(params).encode()).hexdigest()
+
+
+class LayerCache:
+    """Per-octave layers of the last generated grid.
+
+    Raising the octave count only computes the new layers and changing
+    persistence just re-sums the cached ones. The stack is capped at
+    max_bytes; grids whose layers do not fit are generated without it.
+    """
+
+    def __init__(self, max_bytes=2 << 30):
+        self.max_bytes = max_bytes
+        self.key = None
+        self.layers = []
+        self.reused = 0
+        self.computed = 0
+        self.lock = threading.Lock()
+
+    @property
+    def bytes(self):
+        return sum(layer.nbytes for layer in self.layers)
+
+    def generate_noise_map(self, width, height, scale=100.0, octaves=6, persistence=0.5, lacunarity=2.0,
+                           seed=0, **kwargs):
+        """lib.generate_noise_map reusing the cached octave layers.
+
+        Layers are made by the NumPy kernel. With backend left to "auto"
+        (and no NOISE_BACKEND_ENV) they are used whatever backend auto would
+        pick, every backend giving the same map; any other explicit backend
+        generates the map with that backend and leaves the layers alone.
+        """
+        backend = kwargs.pop("backend", None)
+        explicit = backend or os.environ.get(lib.NOISE_BACKEND_ENV) or "auto"
+        if (explicit not in ("auto", "numpy")
+                or octaves * width * height * np.dtype(np.float32).itemsize > self.max_bytes):
+            return lib.generate_noise_map(width, height, scale=scale, octaves=octaves,
+                                          persistence=persistence, lacunarity=lacunarity,
+                                          seed=seed, backend=backend, **kwargs)
+
+        key = layers_key(width, height, scale, lacunarity, seed)
+        with self.lock:
+            if key != self.key:
+                self.key = key
+                self.layers = []
+
+            reused = min(len(self.layers), octaves)
+            noise_map = lib.generate_noise_map(width, height, scale=scale, octaves=octaves,
+                                               persistence=persistence, lacunarity=lacunarity,
+                                               seed=seed, layers=self.layers, **kwargs)
+            self.reused += reused
+            self.computed += octaves - reused
+
+        return noise_map
+
+    def clear(self):
+        with self.lock:
+            self.key = None
+            self.layers = []
+
+    def stats(self):
+        return {
+            "layers": len(self.layers),
+            "reused": self.reused,
+            "computed": self.computed,
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+        }
+
+
+class SurfaceCache:
+    """The last finished height map (after erosion) and its slopes.
+
+    Changing only the light or the relief exaggeration then skips noise,
+    erosion and np.gradient and just relights the cached gradients. Maps
+    whose gradients do not fit in max_bytes are not kept.
+    """
+
+    def __init__(self, max_bytes=1 << 30):
+        self.max_bytes = max_bytes
+        self.key = None
+        self.noise_map = None
+        self.gradients = None
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    @property
+    def bytes(self):
+        return sum(g.nbytes for g in self.gradients) if self.gradients is not None else 0
+
+    def get_or_generate(self, key, generate):
+        """Cached height map for key, made by generate() on a miss."""
+        with self.lock:
+            if key == self.key:
+                self.hits += 1
+                return self.noise_map
+            self.misses += 1
+
+        noise_map = generate()
+        with self.lock:
+            self.key = key
+            self.noise_map = noise_map
+            self.gradients = None
+        return noise_map
+
+    def get_gradients(self, key, noise_map):
+        """lib.surface_gradients of noise_map, cached if it is the map stored for key."""
+        with self.lock:
+            if key == self.key and self.gradients is not None:
+                return self.gradients
+
+        gradients = lib.surface_gradients(noise_map)
+        with self.lock:
+            if key == self.key and 2 * noise_map.size * np.dtype(np.float32).itemsize <= self.max_bytes:
+                self.gradients = gradients
+        return gradients
+
+    def clear(self):
+        with self.lock:
+            self.key = None
+            self.noise_map = None
+            self.gradients = None
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+        }
+
+
+class ChunkCache:
+    """LRU of rendered world chunks (any object with a byte size) under max_bytes."""
+
+    def __init__(self, max_bytes=256 << 20):
+        self.max_bytes = max_bytes
+        self.chunks = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get_or_render(self, key, render):
+        """Cached chunk for key, made by render() on a miss."""
+        with self.lock:
+            if key in self.chunks:
+                self.chunks.move_to_end(key)
+                self.hits += 1
+                return self.chunks[key]
+            self.misses += 1
+
+        # Rendered outside the lock so other chunks are served meanwhile
+        chunk = render()
+
+        with self.lock:
+            if key not in self.chunks:
+                self.chunks[key] = chunk
+                self.bytes += len(chunk)
+            while self.bytes > self.max_bytes and len(self.chunks) > 1:
+                _, evicted = self.chunks.popitem(last=False)
+                self.bytes -= len(evicted)
+                self.evictions += 1
+
+        return chunk
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": len(self.chunks),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+        }
@@ -0,0 +1,308 @@
+"""Headless terrain generation, without Qt.
+
+Example:
+    python cli.py --width 1024 --height 1024 --seed 42 --terrains terrains.json -o map.png
+"""
+import argparse
+import sys
+import time
+
+import lib
+from telemetry import Telemetry
+
+MAX_FPS = 1000
+MIN_FPS = 30
+PROGRESS_INTERVAL = 1.0
+ANIMATION_FRAMES = 240
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Generate a terrain map without the GUI.")
+    parser.add_argument("--width", type=int, default=1024)
+    parser.add_argument("--height", type=int, default=1024)
+    parser.add_argument("--scale", type=float, default=1.75)
+    parser.add_argument("--octaves", type=int, default=8)
+    parser.add_argument("--persistence", type=float, default=0.5)
+    parser.add_argument("--lacunarity", type=float, default=2.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--variation", type=int, default=255)
+    parser.add_argument("--pixel-size", type=int, default=1,
+                        help="Sample the noise once per NxN block of pixels")
+    parser.add_argument("--pixel-levels", type=int, default=0,
+                        help="Quantize heights to this many levels, 0 for off")
+    parser.add_argument("--erosion", type=int, default=0, metavar="ITERATIONS",
+                        help="Erode the map for this many iterations, 0 for off")
+    parser.add_argument("--erosion-mode", default="both", choices=["both", "thermal", "hydraulic"])
+    parser.add_argument("--hillshade", type=float, default=0.0, metavar="STRENGTH",
+                        help="Blend a hillshade into the colors, 0 (off) to 1")
+    parser.add_argument("--sun-azimuth", type=float, default=lib.SUN_AZIMUTH,
+                        help="Degrees clockwise from the top of the map")
+    parser.add_argument("--sun-altitude", type=float, default=lib.SUN_ALTITUDE, help="Degrees above the horizon")
+    parser.add_argument("--exaggeration", type=float, default=lib.RELIEF_EXAGGERATION,
+                        help="Relief height as a share of the map's longest side")
+    parser.add_argument("--terrains", help="JSON file with a list of terrains (name, level, base[, variation])")
+    parser.add_argument("-o", "--output", default="output.png",
+                        help="Colored map path (.png, .bmp or raw .npy), with --seeds a pattern "
+                             "such as map_{seed}.png")
+    parser.add_argument("--seeds", help='Render a batch of seeds, e.g. "1-100,250"')
+    parser.add_argument("--noise-output", help="Also write the grayscale noise map here")
+    parser.add_argument("--heightmap", help="Also write the full precision heightmap here "
+                                            "(.npy float32, or 16-bit .png/.tif)")
+    parser.add_argument("--normal-map", help="Also write a tangent-space normal map here")
+    parser.add_argument("--compress-level", type=int, default=6, help="PNG compression, 0 (fastest) to 9")
+    parser.add_argument("--workers", type=int, default=1, help="Noise worker processes, 0 for every core")
+    parser.add_argument("--tile-size", type=int, default=0, help="Rows per worker task, 0 for auto")
+    parser.add_argument("--backend", default=None, choices=["auto"] + list(lib.NOISE_BACKENDS),
+                        help=f"Noise implementation, by default the fastest installed one "
+                             f"(also set by {lib.NOISE_BACKEND_ENV})")
+    parser.add_argument("--stream", action="store_true",
+                        help="Generate and write in row bands, for maps larger than memory")
+    parser.add_argument("--raw", metavar="NPY", help="With --stream, spill raw noise here instead of computing it twice")
+    parser.add_argument("--record", metavar="VIDEO", help="Write a reveal video to this path")
+    parser.add_argument("--video-duration", type=int, default=120, help="Video length in seconds")
+    parser.add_argument("--fps", type=int, default=MIN_FPS)
+    parser.add_argument("--animate", metavar="VIDEO", help="Write a time-evolving animation of the map here")
+    parser.add_argument("--frames", type=int, default=ANIMATION_FRAMES, help="Animation length in frames")
+    parser.add_argument("--time-step", type=float, help="Noise time travelled per animation frame")
+    parser.add_argument("--telemetry", metavar="JSON", help="Write per-stage timings here")
+    parser.add_argument("--trace", metavar="JSON", help="Write per-stage timings as a Chrome trace here")
+    parser.add_argument("--profile", metavar="DIR", help="Run every stage under cProfile, writing DIR/<stage>.prof")
+    parser.add_argument("--progress-interval", type=float, default=PROGRESS_INTERVAL,
+                        help="Minimum seconds between progress lines")
+    parser.add_argument("-q", "--quiet", action="store_true")
+    return parser.parse_args(argv)
+
+
+def stage_progress(args, log, text):
+    """Throttled progress(done, total) callback logging text and a percentage."""
+    if args.quiet:
+        return None
+    return lib.throttle(lambda done, total: log(f"{text}: {lib.percent(done, total):.0f}%"),
+                        args.progress_interval)
+
+
+def record(filename, images, width, height, duration, fps, telemetry=None):
+    """Write the reveal video of images to filename, returns the frame count."""
+    frame_count = min(width * height * len(images), duration * fps)
+    fps = max(MIN_FPS, min(MAX_FPS, round(frame_count / duration)))
+    size = lib.video_size(width, height)
+    telemetry = telemetry or Telemetry()
+
+    encoder = lib.VideoEncoder(filename, fps).start()
+    try:
+        with telemetry.stage("video", frame_count * size[0] * size[1]):
+            for frame in lib.reveal_frames(images, frame_count, size):
+                encoder.append(frame)
+    finally:
+        encoder.close()
+
+    telemetry.add("video_encode", encoder.encode_time, pixels=encoder.frames * size[0] * size[1])
+    return encoder.frames
+
+
+def animate_video(args, terrains, log, telemetry):
+    """Write the --animate video, returns its stats."""
+    import animate
+
+    def progress(done, total, stats):
+        log(f"{done}/{total} frames - {stats['frames_per_second']:.2f} frames/s")
+
+    return animate.render_animation(
+        args.animate, args.width, args.height, args.frames,
+        fps=args.fps,
+        scale=args.scale,
+        octaves=args.octaves,
+        persistence=args.persistence,
+        lacunarity=args.lacunarity,
+        seed=args.seed,
+        time_step=animate.TIME_STEP if args.time_step is None else args.time_step,
+        variation=args.variation,
+        terrains=terrains,
+        workers=args.workers or None,
+        progress=None if args.quiet else lib.throttle(progress, args.progress_interval),
+        telemetry=telemetry
+    )
+
+
+def run_batch(args, terrains, log):
+    import batch
+
+    if args.pixel_size > 1 or args.pixel_levels > 0:
+        log("--pixel-size and --pixel-levels are ignored with --seeds")
+    if args.animate or args.erosion > 0 or args.hillshade > 0 or args.normal_map:
+        log("--animate, --erosion, --hillshade and --normal-map are ignored with --seeds")
+
+    jobs = batch.seed_jobs(
+        batch.parse_seeds(args.seeds), args.width, args.height,
+        scale=args.scale,
+        octaves=args.octaves,
+        persistence=args.persistence,
+        lacunarity=args.lacunarity,
+        # Chosen once here rather than in every worker
+        backend=lib.resolve_backend(args.backend, args.width)
+    )
+
+    try:
+        batch.output_paths(jobs, args.output)
+    except ValueError as error:
+        print(error, file=sys.stderr)
+        return 2
+
+    def progress(done, total, stats):
+        log(f"{done}/{total} maps - {stats['maps_per_second']:.2f} maps/s, "
+            f"{stats['megapixels_per_second']:.2f} MP/s")
+
+    batch.render_batch(jobs, args.output, variation=args.variation, terrains=terrains,
+                       workers=args.workers or None, progress=lib.throttle(progress, args.progress_interval))
+    return 0
+
+
+def run_stream(args, terrains, log, start):
+    if args.record or args.animate:
+        log("--record and --animate are ignored with --stream")
+    if args.pixel_size > 1 or args.pixel_levels > 0:
+        log("--pixel-size and --pixel-levels are ignored with --stream")
+    if args.erosion > 0 or args.hillshade > 0 or args.normal_map:
+        log("--erosion, --hillshade and --normal-map are ignored with --stream")
+    if args.heightmap:
+        log("--heightmap is ignored with --stream, see --raw")
+
+    lib.stream_map(
+        args.width, args.height,
+        output=args.output,
+        noise_output=args.noise_output,
+        scale=args.scale,
+        octaves=args.octaves,
+        persistence=args.persistence,
+        lacunarity=args.lacunarity,
+        seed=args.seed,
+        variation=args.variation,
+        terrains=terrains,
+        raw_path=args.raw,
+        backend=args.backend,
+        band_rows=args.tile_size,
+        compress_level=args.compress_level,
+        progress=stage_progress(args, log, "Streaming map")
+    )
+    log(f"Wrote {args.output}: {time.perf_counter() - start:.2f}s")
+    return 0
+
+
+def save_telemetry(args, telemetry, log):
+    if args.telemetry:
+        telemetry.save_json(args.telemetry)
+    if args.trace:
+        telemetry.save_chrome_trace(args.trace)
+    if args.profile:
+        telemetry.save_profiles(args.profile)
+    log(telemetry.format_table())
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    log = (lambda *a: None) if args.quiet else (lambda *a: print(*a, file=sys.stderr))
+    start = time.perf_counter()
+    telemetry = Telemetry(profile=bool(args.profile))
+
+    terrains = lib.load_terrains(args.terrains)
+
+    if args.seeds:
+        return run_batch(args, terrains, log)
+
+    if args.stream:
+        return run_stream(args, terrains, log, start)
+
+    pixels = args.width * args.height
+    pixel_size = lib.clamp_block(args.width, args.height, args.pixel_size)
+    if pixel_size != args.pixel_size:
+        log(f"--pixel-size lowered to {pixel_size} to sample at least 2x2 values")
+        args.pixel_size = pixel_size
+    noise_w, noise_h = lib.pixelated_size(args.width, args.height, args.pixel_size)
+    with telemetry.stage("noise", noise_w * noise_h):
+        nmap = lib.generate_noise_map(
+            noise_w, noise_h,
+            scale=args.scale,
+            octaves=args.octaves,
+            persistence=args.persistence,
+            lacunarity=args.lacunarity,
+            seed=args.seed,
+            workers=args.workers or None,
+            tile_size=args.tile_size,
+            backend=args.backend,
+            progress=stage_progress(args, log, "Noise map"),
+            telemetry=telemetry
+        )
+    log(f"Noise map: {time.perf_counter() - start:.2f}s")
+
+    if args.erosion > 0:
+        import erosion
+
+        with telemetry.stage("erosion", noise_w * noise_h):
+            nmap = erosion.erode(
+                nmap,
+                iterations=args.erosion,
+                thermal=args.erosion_mode != "hydraulic",
+                hydraulic=args.erosion_mode != "thermal",
+                workers=args.workers or None,
+                band_rows=args.tile_size,
+                progress=stage_progress(args, log, "Erosion")
+            )
+        log(f"Erosion: {time.perf_counter() - start:.2f}s")
+
+    # Slopes of the eroded map, before it is quantized into pixel levels
+    gradients = None
+    if args.hillshade > 0 or args.normal_map:
+        with telemetry.stage("gradients", noise_w * noise_h):
+            gradients = lib.surface_gradients(nmap)
+
+    if args.pixel_levels > 0:
+        nmap = lib.pixelate_map(nmap, args.pixel_levels)
+
+    with telemetry.stage("quantize", noise_w * noise_h):
+        levels = lib.quantize_map(nmap)
+    with telemetry.stage("colorize", noise_w * noise_h):
+        colors = lib.colorize(nmap, variation=args.variation, terrains=terrains)
+
+    if args.hillshade > 0:
+        with telemetry.stage("hillshade", noise_w * noise_h):
+            shade = lib.hillshade(gradients, args.sun_azimuth, args.sun_altitude, args.exaggeration)
+            colors = lib.shade_colors(colors, shade, args.hillshade, args.sun_altitude)
+
+    if args.pixel_size > 1:
+        with telemetry.stage("upscale", pixels):
+            levels = lib.upscale_blocks(levels, args.pixel_size, args.width, args.height)
+            colors = lib.upscale_blocks(colors, args.pixel_size, args.width, args.height)
+
+    outputs = [(colors, args.output)]
+    if args.normal_map:
+        with telemetry.stage("normal_map", noise_w * noise_h):
+            normals = lib.normal_map(gradients, args.exaggeration)
+        if args.pixel_size > 1:
+            normals = lib.upscale_blocks(normals, args.pixel_size, args.width, args.height)
+        outputs.append((normals, args.normal_map))
+    if args.noise_output:
+        outputs.append((levels, args.noise_output))
+    if args.heightmap:
+        heights = nmap
+        if args.pixel_size > 1:
+            heights = lib.upscale_blocks(nmap, args.pixel_size, args.width, args.height)
+        outputs.append((heights, args.heightmap))
+    lib.save_outputs(outputs, compress_level=args.compress_level, telemetry=telemetry)
+    log(f"Wrote {args.output}: {time.perf_counter() - start:.2f}s")
+
+    if args.record:
+        frames = record(args.record, [levels, colors], args.width, args.height, args.video_duration, args.fps,
+                        telemetry=telemetry)
+        log(f"Wrote {args.record} ({frames} frames): {time.perf_counter() - start:.2f}s")
+
+    if args.animate:
+        stats = animate_video(args, terrains, log, telemetry)
+        log(f"Wrote {args.animate} ({stats['frames']} frames, {stats['frames_per_second']:.2f} frames/s): "
+            f"{time.perf_counter() - start:.2f}s")
+
+    save_telemetry(args, telemetry, log)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,224 @@
+"""Thermal and hydraulic erosion of noise maps.
+
+Both run as whole-array stencil updates on the 4 neighbours of every cell:
+
+- thermal erosion moves material down slopes steeper than the talus slope;
+- hydraulic erosion rains water on the map, lets it flow towards lower
+  neighbours, dissolves material where the flow can carry more sediment
+  than it does and deposits it where it carries less.
+
+Heights are handled in pixel units (scaled by the map's longest side), so
+slopes, and the parameters below, mean the same at every map size. Only
+erode is meant to be called from outside.
+"""
+import os
+
+import numpy as np
+
+import lib
+
+DEFAULT_ITERATIONS = 50
+# Slope (height per pixel) above which material slides
+TALUS = 4.0
+# Share of the excess slope removed per iteration
+THERMAL_RATE = 0.5
+RAIN = 0.5
+# Sediment carried per unit of moving water
+CAPACITY = 4.0
+SOLUBILITY = 0.3
+DEPOSITION = 0.3
+EVAPORATION = 0.02
+# Iterations run by a worker between two exchanges of band borders
+SYNC_ITERATIONS = 8
+# A cell's new state depends on cells this far away after one iteration
+_REACH = 4
+
+
+def _neighbours(array):
+    """Views of the up, down, left and right neighbours, repeating the border."""
+    padded = np.pad(array, 1, mode="edge")
+    return padded[:-2, 1:-1], padded[2:, 1:-1], padded[1:-1, :-2], padded[1:-1, 2:]
+
+
+def _spread(total, drops, amount):
+    """Split amount between the neighbours by their share of the positive drops."""
+    share = np.divide(amount, total, out=np.zeros_like(amount), where=total > 0)
+    return [drop * share for drop in drops]
+
+
+def _inflow(up, down, left, right):
+    """What every cell receives from the outflows of its neighbours."""
+    inflow = np.zeros_like(up)
+    inflow[:-1] += up[1:]
+    inflow[1:] += down[:-1]
+    inflow[:, :-1] += left[:, 1:]
+    inflow[:, 1:] += right[:, :-1]
+    return inflow
+
+
+def thermal_step(height, talus=TALUS, rate=THERMAL_RATE):
+    """One thermal erosion iteration, returns the new heights."""
+    diffs = [height - n for n in _neighbours(height)]
+    drops = [np.maximum(d - talus, 0) for d in diffs]
+    total = sum(drops)
+    moved = np.maximum(np.maximum.reduce(diffs) - talus, 0) * np.float32(rate * 0.5)
+
+    outflow = _spread(total, drops, moved)
+    return height - moved + _inflow(*outflow)
+
+
+def hydraulic_step(height, water, sediment, rain=RAIN, capacity=CAPACITY, solubility=SOLUBILITY,
+                   deposition=DEPOSITION, evaporation=EVAPORATION):
+    """One hydraulic erosion iteration, returns the new (height, water, sediment)."""
+    water = water + np.float32(rain)
+    surface = height + water
+
+    diffs = [surface - n for n in _neighbours(surface)]
+    drops = [np.maximum(d, 0) for d in diffs]
+    total = sum(drops)
+    moved = np.minimum(water, np.maximum(np.maximum.reduce(diffs), 0) * np.float32(0.5))
+
+    # Dissolve or deposit towards what the moving water can carry, never
+    # digging below the lowest neighbour (that makes pits that oscillate)
+    excess = moved * np.float32(capacity) - sediment
+    floor = np.maximum(np.maximum.reduce([height - n for n in _neighbours(height)]), 0) * np.float32(0.5)
+    change = np.where(excess > 0, np.minimum(excess * np.float32(solubility), floor),
+                      excess * np.float32(deposition))
+    height = height - change
+    sediment = sediment + change
+
+    # Sediment leaves with the same share of the water
+    carried = sediment * np.divide(moved, water, out=np.zeros_like(water), where=water > 0)
+
+    water = water - moved + _inflow(*_spread(total, drops, moved))
+    sediment = sediment - carried + _inflow(*_spread(total, drops, carried))
+    return height, water * np.float32(1 - evaporation), sediment
+
+
+def _run(height, water, sediment, iterations, thermal, hydraulic):
+    for _ in range(iterations):
+        if hydraulic is not None:
+            height, water, sediment = hydraulic_step(height, water, sediment, **hydraulic)
+        if thermal is not None:
+            height = thermal_step(height, **thermal)
+    return height, water, sediment
+
+
+def _erode_band(names, shape, source, row_start, row_end, iterations, thermal, hydraulic):
+    """Process pool task: advance rows [row_start, row_end) by iterations.
+
+    Reads the state from the source half of the shared arrays and writes the
+    other half. The band is computed with enough rows around it that the
+    cells it keeps never see the cut, so bands match a whole-map run exactly.
+    """
+    from multiprocessing import shared_memory
+
+    halo = _REACH * iterations
+    top = max(0, row_start - halo)
+    bottom = min(shape[0], row_end + halo)
+
+    shms = [shared_memory.SharedMemory(name=name) for name in names]
+    try:
+        arrays = [np.ndarray((2,) + shape, dtype=np.float32, buffer=shm.buf) for shm in shms]
+        state = [array[source, top:bottom].copy() for array in arrays]
+        state = _run(*state, iterations, thermal, hydraulic)
+        for array, values in zip(arrays, state):
+            array[1 - source, row_start:row_end] = values[row_start - top:row_end - top]
+        del arrays
+    finally:
+        for shm in shms:
+            shm.close()
+
+
+def erode(noise_map, iterations=DEFAULT_ITERATIONS, thermal=True, hydraulic=True, talus=TALUS,
+          thermal_rate=THERMAL_RATE, rain=RAIN, capacity=CAPACITY, solubility=SOLUBILITY,
+          deposition=DEPOSITION, evaporation=EVAPORATION, workers=1, band_rows=None,
+          sync_iterations=SYNC_ITERATIONS, cancel=None, progress=None):
+    """Eroded copy of a normalized noise map, clipped to [0, 1].
+
+    Each iteration runs a hydraulic then a thermal step, either of them can
+    be turned off. The input is never modified, so read-only cached maps can
+    be passed directly. Sediment still carried after the last iteration is
+    dropped where it is.
+
+    workers > 1 splits the map into bands of band_rows rows computed in a
+    process pool (None uses every core). Bands exchange their borders every
+    sync_iterations iterations and the result is the same as a
+    single-process run. cancel is an optional callable polled between
+    iterations; once it returns True, Cancelled is raised.
+    progress(done, total) counts rows times iterations, wrap it with
+    lib.throttle to rate-limit it.
+    """
+    height_px, width_px = noise_map.shape
+    unit = np.float32(max(height_px, width_px))
+    thermal = {"talus": talus, "rate": thermal_rate} if thermal else None
+    hydraulic = {"rain": rain, "capacity": capacity, "solubility": solubility,
+                 "deposition": deposition, "evaporation": evaporation} if hydraulic else None
+
+    height = noise_map.astype(np.float32) * unit
+    water = np.zeros_like(height)
+    sediment = np.zeros_like(height)
+    total = iterations * height_px
+
+    if band_rows is None or band_rows <= 0:
+        band_rows = max(1, lib.BLOCK_PIXELS // width_px)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = min(workers, -(-height_px // band_rows))
+
+    if workers <= 1:
+        for iteration in range(iterations):
+            lib.check_cancel(cancel)
+            height, water, sediment = _run(height, water, sediment, 1, thermal, hydraulic)
+            if progress is not None:
+                progress((iteration + 1) * height_px, total)
+    else:
+        height, water, sediment = _erode_pool((height, water, sediment), iterations, thermal, hydraulic,
+                                              workers, band_rows, sync_iterations, cancel, progress)
+
+    height = height + sediment
+    return np.clip(height / unit, 0.0, 1.0).astype(noise_map.dtype)
+
+
+def _erode_pool(state, iterations, thermal, hydraulic, workers, band_rows, sync_iterations, cancel, progress):
+    """erode's process pool path, returns the final (height, water, sediment).
+
+    Every state array lives in shared memory twice, passes alternate between
+    reading one half and writing the other.
+    """
+    # Imported here, the process pool machinery is slow to import
+    from concurrent.futures import ProcessPoolExecutor
+    from multiprocessing import shared_memory
+
+    shape = state[0].shape
+    total = iterations * shape[0]
+    bands = [(row, min(shape[0], row + band_rows)) for row in range(0, shape[0], band_rows)]
+    shms = [shared_memory.SharedMemory(create=True, size=2 * state[0].nbytes) for _ in state]
+    try:
+        arrays = [np.ndarray((2,) + shape, dtype=np.float32, buffer=shm.buf) for shm in shms]
+        for array, values in zip(arrays, state):
+            array[0] = values
+
+        names = [shm.name for shm in shms]
+        source = 0
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for start in range(0, iterations, sync_iterations):
+                count = min(sync_iterations, iterations - start)
+                tasks = [pool.submit(_erode_band, names, shape, source, row_start, row_end, count,
+                                     thermal, hydraulic)
+                         for row_start, row_end in bands]
+
+                report = None
+                if progress is not None:
+                    report = lambda done, _, offset=start * shape[0]: progress(offset + done, total)
+                lib._wait_tasks(tasks, cancel, report, [(end - row) * count for row, end in bands])
+                source = 1 - source
+
+        state = [array[source].copy() for array in arrays]
+        del arrays
+    finally:
+        for shm in shms:
+            shm.close()
+            shm.unlink()
+
+    return state
@@ -1,51 +1,117 @@
+import copy
+import os
+import shutil
 import sys
+import threading
+import traceback
 from sys import argv as args
 import random
 from PyQt6.QtWidgets import (
     QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout,
     QLabel, QSpinBox, QDoubleSpinBox, QPushButton,
-    QGroupBox, QFormLayout, QScrollArea, QLineEdit, QColorDialog, QCheckBox
+    QGroupBox, QFormLayout, QScrollArea, QLineEdit, QColorDialog, QCheckBox, QComboBox
 )
-from PyQt6.QtCore import Qt, QThread, pyqtSignal
+from PyQt6.QtCore import Qt, QThread, QTimer, pyqtSignal
 from PyQt6.QtGui import QImage, QPixmap, QFont
 import lib
-import imageio.v3 as iio
-import imageio
+import cache
+import erosion
+from viewer import TileViewer
+from telemetry import Telemetry
 import time
 import numpy as np
-from PIL.Image import Image, NEAREST
 
 SEED_MIN = 0
 SEED_MAX = 100000
 OUTPUT_FN = "output.png"
-MAX_TERRAIN_SIZE = 8192
+NOISE_FN = "noise.png"
+# Color output choices
+OUTPUT_FORMATS = {"PNG": OUTPUT_FN, "BMP (uncompressed)": "output.bmp", "Raw RGB (.npy)": "output.npy"}
+# Full precision heightmap choices
+HEIGHTMAP_FORMATS = {"No heightmap": None, "float32 .npy": "heightmap.npy",
+                     "16-bit PNG": "heightmap.png", "16-bit TIFF": "heightmap.tif"}
+DEFAULT_COMPRESS_LEVEL = 6
+MAX_TERRAIN_SIZE = 32768
+MAX_PIXEL_SIZE = 64
+MAX_EROSION_ITERATIONS = 1000
+# erosion.erode arguments of each erosion choice
+EROSION_MODES = {"Thermal + hydraulic": {}, "Thermal": {"hydraulic": False}, "Hydraulic": {"thermal": False}}
+# Bigger maps are streamed to disk in row bands
+STREAM_PIXELS = 8192 * 8192
+# Longest side of the image shown for streamed maps
+STREAM_DISPLAY_SIZE = 2048
+# Colors of a streamed map, only kept until its pyramid is exported
+STREAM_RGB_FN = "output_rgb.npy"
+# Bigger maps are also exported as a tile pyramid for the viewer
+PYRAMID_PIXELS = 2048 * 2048
+PYRAMID_DIR = "tiles"
 MAX_FPS = 1000
 MIN_FPS = 30
+VIDEO_QUEUE_SIZE = 32
+ANIMATION_FN = "animation.mp4"
+MAX_ANIMATION_FRAMES = 3600
+NOISE_CACHE_BYTES = 1 << 30
+NOISE_CACHE_DIR = ".noise_cache"
+LAYER_CACHE_BYTES = 2 << 30
+SURFACE_CACHE_BYTES = 1 << 30
+NORMAL_FN = "normal.png"
+MAX_EXAGGERATION = 2.0
+PREVIEW_STEPS = (16, 4)
+LIVE_DEBOUNCE_MS = 300
+MAX_WORKERS = os.cpu_count() or 1
+# Written after each run with Profile checked
+TELEMETRY_FN = "telemetry.json"
+TRACE_FN = "trace.json"
+PROFILE_DIR = "profiles"
+
+
+def array_to_qimage(array):
+    """QImage over a (h, w, 3) uint8 array without copying.
+
+    The array must outlive the image and every shallow copy of it.
+    """
+    h, w = array.shape[:2]
+    return QImage(array.data, w, h, array.strides[0], QImage.Format.Format_RGB888)
 
 
 class TerrainWorker(QThread):
     """Worker thread for terrain generation to prevent UI freezing"""
     finished = pyqtSignal(QImage)
+    rendered = pyqtSignal(QImage)  # final image, before it is written to disk
+    preview = pyqtSignal(QImage, int)  # image, sampling step
+    cancelled = pyqtSignal()
+    failed = pyqtSignal(str)  # error message
+    pyramid_ready = pyqtSignal(str)  # tile pyramid directory
     progress = pyqtSignal(int, int, float, str)  # current, total
     
-    def __init__(self, params, terrains):
+    def __init__(self, params, terrains, noise_cache=None, surface_cache=None):
         super().__init__()
         self.params = params
         self.terrains = terrains
+        self.noise_cache = noise_cache
+        self.surface_cache = surface_cache
         self.start_time = time.time()
-        self.last_emit = time.time()
+        self.report = lib.throttle(self.progress_emit)
         self.video_filename = "output.mp4"
         self.total_time = 0
         self.target_resolutuion_width = 1080
         self.w = self.params['w']
         self.h = self.params['h']
         self.video_duration = 120
+        self.video_fps = MIN_FPS
         self.frames = 0
         self.record = params['record']
+        self.first_preview_time = None
+        self.encoder = None
+        self.telemetry = Telemetry(profile=params['profile'])
+        # Backing buffer of the QImage emitted by rendered, kept for the worker's lifetime
+        self.image_array = None
+        # Exception raised by the PNG writer thread, re-raised by generate
+        self.write_error = None
 
     
-    def start_record(self):
-        fps = round(self.frames / self.video_duration)
+    def start_record(self, frame_count):
+        fps = round(frame_count / self.video_duration)
 
         if fps < MIN_FPS:
             fps = MIN_FPS
@@ -53,139 +119,366 @@ class TerrainWorker(QThread):
         if fps > MAX_FPS:
             fps = MAX_FPS
 
-        self.writer = imageio.get_writer(self.video_filename, fps=fps)
-        self.frame_buffer = []
+        self.video_size = lib.video_size(self.w, self.h, self.target_resolutuion_width)
+        self.encoder = lib.VideoEncoder(self.video_filename, fps,
+                                        queue_size=VIDEO_QUEUE_SIZE,
+                                        progress=self.encode_progress).start()
 
 
-    def append_video(self, frame: Image):
-        aspect_ratio = self.h / self.w
+    def append_video(self, frame: np.ndarray):
+        self.encoder.append(frame)
 
-        times_bigger_h = self.target_resolutuion_width * aspect_ratio / self.h
-        times_bigger_w = self.target_resolutuion_width / self.w
 
-        if times_bigger_h >= 1 :
-            times_bigger_h = round(times_bigger_h)
-        
-        if times_bigger_w >= 1:
-            times_bigger_w = round(times_bigger_w)
+    def encode_progress(self, frames, frames_per_second):
+        self.report(frames, self.frames, f"Encoding video ({frames_per_second:.1f} frames/s)")
 
-        if times_bigger_h < 1:
-            times_bigger_h = round(times_bigger_h, 1)
 
-        if times_bigger_w < 1:
-            times_bigger_w = round(times_bigger_w, 1)
+    def stop_record(self):
+        self.encoder.close()
+        print(f"Encoded {self.encoder.frames} frames at {self.encoder.frames_per_second:.1f} frames/s")
 
-        final_resolution_h = int(self.h * times_bigger_h)
-        final_resolution_w = int(self.w * times_bigger_w)
 
-        frame = frame.resize((final_resolution_w, final_resolution_h), resample=NEAREST)
+    def preview_emit(self, colors, step):
+        # Previews are small, copy them instead of keeping their arrays alive
+        qimage = array_to_qimage(colors).copy()
 
-        frame_np = np.asarray(frame)
+        if self.first_preview_time is None:
+            self.first_preview_time = time.time() - self.start_time
+        self.preview.emit(qimage, step)
 
-        self.writer.append_data(frame_np)
 
+    def render_previews(self, noise_params):
+        """Emit coarse previews while the full map has not been generated yet."""
+        if self.noise_cache is not None and self.noise_cache.contains(cache.noise_key(**noise_params)):
+            return
 
-    def stop_record(self):
-        if self.frame_buffer:
-            self._flush_buffer()
+        previews = lib.progressive_noise(**noise_params, steps=PREVIEW_STEPS, cancel=self.isInterruptionRequested)
+        with self.telemetry.stage("previews"):
+            for step, preview in previews:
+                if step >= min(noise_params['width'], noise_params['height']):
+                    continue
+                colors = lib.colorize(preview, variation=self.params['variation'], terrains=self.terrains)
+                self.preview_emit(colors, step)
 
-        self.writer.close()        
 
+    def stage_progress(self, text):
+        """progress(done, total) callback for lib functions, reported as text."""
+        return lambda done, total: self.report(done, total, text)
 
-    def progress_emit(self, current, total, text="Generating color map"):
-        if time.time() - self.last_emit < 0.1:
-            return
-        self.last_emit = time.time()
 
+    def progress_emit(self, current, total, text="Generating color map"):
         self.total_time = time.time() - self.start_time
         self.progress.emit(current, total, self.total_time, text)
 
         
     def run(self):
+        try:
+            self.generate()
+        except lib.Cancelled:
+            # Everything generate() allocated is released with its frame
+            self.discard_record()
+            print("Cancelled")
+            self.cancelled.emit()
+        except Exception as error:
+            traceback.print_exc()
+            self.discard_record()
+            self.failed.emit(str(error))
+
+
+    def discard_record(self):
+        """Close a recording left open by an interrupted run, never raising."""
+        if self.encoder is None:
+            return
+        try:
+            self.encoder.close(discard=True)
+        except Exception:
+            traceback.print_exc()
+
+
+    def generate(self):
+        cancel = self.isInterruptionRequested
         w = self.w
         h = self.h
 
         scale = self.params['scale']
         octaves = self.params['octaves']
-        #pixelation_levels = self.params['pixelation_levels']
+        pixel_size = self.params['pixel_size']
+        pixelation_levels = self.params['pixelation_levels']
         variation = self.params['variation']
         seed = self.params['seed']
-        
-        # Generate noise map
-        nmap = lib.generate_noise_map(
-            w, h, 
-            scale=scale, 
-            octaves=octaves, 
-            persistence=0.5, 
-            seed=seed, 
-            lacunarity=2.0
-        )
 
-        #nmap_pixel = lib.pixelate_map(nmap, pixelation_levels)
+        if w * h > STREAM_PIXELS:
+            pixel_size = 1
+        pixel_size = lib.clamp_block(w, h, pixel_size)
+
+        # Pixelated maps are sampled once per block and blown up at the end
+        noise_w, noise_h = lib.pixelated_size(w, h, pixel_size)
 
-        # Save noise map w/o pixelation
-        noise_img = lib.create_image(w, h, (0, 0, 0))
-        frame = 0
+        noise_params = {
+            'width': noise_w,
+            'height': noise_h,
+            'scale': scale,
+            'octaves': octaves,
+            'persistence': self.params['persistence'],
+            'lacunarity': self.params['lacunarity'],
+            'seed': seed
+        }
+
+        # No previews for streamed maps, they would need whole-map buffers
+        if w * h > STREAM_PIXELS:
+            self.stream(noise_params, cancel)
+            return
 
-        frame_count = (nmap.shape[0] * nmap.shape[1])*2
+        if self.params['preview']:
+            self.render_previews(noise_params)
+
+        # Reused as is when only colors or the light changed
+        surface_key = (cache.noise_key(**noise_params), self.params['erosion_iterations'],
+                       self.params['erosion_mode'])
+        if self.surface_cache is not None:
+            nmap = self.surface_cache.get_or_generate(surface_key, lambda: self.surface(noise_params, cancel))
+        else:
+            nmap = self.surface(noise_params, cancel)
+
+        shading = self.params['shade_strength'] > 0 or self.params['normal_map']
+        if shading:
+            with self.telemetry.stage("gradients", noise_w * noise_h):
+                if self.surface_cache is not None:
+                    gradients = self.surface_cache.get_gradients(surface_key, nmap)
+                else:
+                    gradients = lib.surface_gradients(nmap)
+
+        if pixelation_levels > 0:
+            nmap = lib.pixelate_map(nmap, pixelation_levels)
+
+        frame_count = (w * h)*2
         self.frames = frame_count
         total_steps = frame_count
-        step_add = 1
         step = 0
 
-        for y in range(nmap.shape[0]):
-            for x in range(nmap.shape[1]):
-                value = int(nmap[y, x] * 255)
-                noise_img = lib.draw_pixel(noise_img, x, y, (value, value, value))
-                step += step_add
-                self.progress_emit(step, total_steps)
-        noise_img.save("noise.png")
-        
-        # Create image
-        img = lib.create_image(w, h, (0, 0, 0))
+        with self.telemetry.stage("quantize", noise_w * noise_h):
+            levels = lib.quantize_map(nmap)
+        step += w * h
+        self.report(step, total_steps, "Generating color map")
 
         # Save colored version
-        for y in range(nmap.shape[0]):
-            for x in range(nmap.shape[1]):
-                value = lib.noise_color(int(nmap[y, x] * 255), variation=variation, terrains=self.terrains)
-                
-                img = lib.draw_pixel(img, x, y, value)
-                step += step_add
-                self.progress_emit(step, total_steps)
+        lib.check_cancel(cancel)
+        with self.telemetry.stage("colorize", noise_w * noise_h):
+            colors = lib.colorize(nmap, variation=variation, terrains=self.terrains)
+        step += w * h
+        self.report(step, total_steps, "Generating color map")
+
+        if self.params['shade_strength'] > 0:
+            with self.telemetry.stage("hillshade", noise_w * noise_h):
+                shade = lib.hillshade(gradients, self.params['sun_azimuth'], self.params['sun_altitude'],
+                                      self.params['exaggeration'])
+                colors = lib.shade_colors(colors, shade, self.params['shade_strength'], self.params['sun_altitude'])
+
+        normals = None
+        if self.params['normal_map']:
+            with self.telemetry.stage("normal_map", noise_w * noise_h):
+                normals = lib.normal_map(gradients, self.params['exaggeration'])
+
+        if pixel_size > 1:
+            with self.telemetry.stage("upscale", w * h):
+                levels = lib.upscale_blocks(levels, pixel_size, w, h)
+                colors = lib.upscale_blocks(colors, pixel_size, w, h)
+
+        # Show the result right away, PNG encoding happens in the background
+        self.image_array = colors
+        qimage = array_to_qimage(colors)
+        self.rendered.emit(qimage)
 
         print("Writing data...")
-        img.save(OUTPUT_FN)
+        writer = threading.Thread(target=self.write_outputs,
+                                  args=(levels, colors, nmap, pixel_size, normals, cancel))
+        writer.start()
+
+        # The writer is joined on every exit so it never outlives the run
+        # and races the next one on the same files
+        try:
+            # Write video
+            if self.record:
+                self.total_time = 0
+                # Fixed budget of frames, each revealing an equal batch of pixels
+                self.frames = min(total_steps, self.video_duration * self.video_fps)
+
+                self.start_record(self.frames)
+                frames = lib.reveal_frames([levels, colors], self.frames, self.video_size, cancel=cancel)
+
+                # Frame synthesis only, time spent waiting on the encoder queue is left out
+                synthesis = 0
+                while True:
+                    start = time.perf_counter()
+                    frame = next(frames, None)
+                    synthesis += time.perf_counter() - start
+                    if frame is None:
+                        break
+                    self.append_video(frame)
+
+                self.stop_record()
+                frame_pixels = self.frames * self.video_size[0] * self.video_size[1]
+                self.telemetry.add("video_frames", synthesis, pixels=frame_pixels)
+                self.telemetry.add("video_encode", self.encoder.encode_time, pixels=frame_pixels)
+
+            if self.params['animation_frames'] > 0:
+                self.animate(cancel)
+        finally:
+            writer.join()
+
+        if self.write_error is not None:
+            raise self.write_error
+
+        print("Finished!")
+        self.finished.emit(qimage)
+
+
+    def animate(self, cancel):
+        """Write the map evolving through time to ANIMATION_FN."""
+        import animate
+
+        def progress(done, total, stats):
+            self.report(done, total, f"Animating ({stats['frames_per_second']:.1f} frames/s)")
+
+        stats = animate.render_animation(
+            ANIMATION_FN, self.w, self.h, self.params['animation_frames'],
+            fps=self.video_fps,
+            queue_size=VIDEO_QUEUE_SIZE,
+            scale=self.params['scale'],
+            octaves=self.params['octaves'],
+            persistence=self.params['persistence'],
+            lacunarity=self.params['lacunarity'],
+            seed=self.params['seed'],
+            variation=self.params['variation'],
+            terrains=self.terrains,
+            workers=self.params['workers'],
+            progress=progress,
+            telemetry=self.telemetry,
+            cancel=cancel
+        )
+        print(f"Animated {stats['frames']} frames at {stats['frames_per_second']:.1f} frames/s "
+              f"(encoding {stats['encode_frames_per_second']:.1f} frames/s)")
+
+
+    def surface(self, noise_params, cancel):
+        """Noise map of noise_params after erosion."""
+        # Reused from the noise cache when only erosion changed
+        generate = self.noise_cache.get_or_generate if self.noise_cache else lib.generate_noise_map
+        with self.telemetry.stage("noise", noise_params['width'] * noise_params['height']):
+            nmap = generate(
+                **noise_params,
+                workers=self.params['workers'],
+                tile_size=self.params['tile_size'],
+                backend=self.params['backend'],
+                cancel=cancel,
+                progress=self.stage_progress("Generating noise map"),
+                telemetry=self.telemetry
+            )
+
+        # Eroded into a new array, cached maps are read-only
+        if self.params['erosion_iterations'] > 0:
+            with self.telemetry.stage("erosion", noise_params['width'] * noise_params['height']):
+                nmap = erosion.erode(
+                    nmap,
+                    iterations=self.params['erosion_iterations'],
+                    **EROSION_MODES[self.params['erosion_mode']],
+                    workers=self.params['workers'],
+                    band_rows=self.params['tile_size'],
+                    cancel=cancel,
+                    progress=self.stage_progress("Eroding")
+                )
+
+        return nmap
+
+
+    def stream(self, noise_params, cancel):
+        """Write maps too big for memory band by band, showing a subsampled copy."""
+        if self.record or self.params['animation_frames'] > 0:
+            print("Recording and animation are not available for streamed maps")
+        if self.params['pixel_size'] > 1 or self.params['pixelation_levels'] > 0:
+            print("Pixelation is not available for streamed maps")
+        if self.params['erosion_iterations'] > 0 or self.params['shade_strength'] > 0 or self.params['normal_map']:
+            print("Erosion and shading are not available for streamed maps")
+        if self.params['output'] != OUTPUT_FN or self.params['heightmap'] is not None:
+            print(f"Streamed maps are only written as {OUTPUT_FN} and {NOISE_FN}")
+
+        step = -(-max(self.w, self.h) // STREAM_DISPLAY_SIZE)
+        display_rows = []
+
+        def band_done(row_start, row_end, colors):
+            first = -(-row_start // step) * step
+            display_rows.append(colors[first - row_start::step, ::step].copy())
+
+        print("Streaming data...")
+        try:
+            with self.telemetry.stage("stream", self.w * self.h):
+                lib.stream_map(
+                    **noise_params,
+                    output=OUTPUT_FN,
+                    noise_output=NOISE_FN,
+                    compress_level=self.params['compress_level'],
+                    variation=self.params['variation'],
+                    terrains=self.terrains,
+                    rgb_output=STREAM_RGB_FN,
+                    band_rows=self.params['tile_size'],
+                    backend=self.params['backend'],
+                    band_callback=band_done,
+                    cancel=cancel,
+                    progress=self.stage_progress("Streaming map")
+                )
+
+            self.image_array = np.ascontiguousarray(np.concatenate(display_rows))
+            qimage = array_to_qimage(self.image_array)
+            self.rendered.emit(qimage)
+
+            self.export_pyramid(np.load(STREAM_RGB_FN, mmap_mode="r"), cancel)
+        finally:
+            if os.path.exists(STREAM_RGB_FN):
+                os.remove(STREAM_RGB_FN)
 
-        # Write video
-        if self.record:
-            self.total_time = 0
-            step = 0
-            
-            self.start_record()
-            files = [noise_img, img]
-            temp_file = lib.create_image(w, h, (0, 0, 0))
-            for file in files:
-                for height in range(h):
-                    for width in range(w):
-                        self.progress_emit(step, total_steps, "Generating video")
-                        temp_file = lib.draw_pixel(temp_file, width, height, file.getpixel((width, height)))
-                        self.append_video(temp_file.copy())
-                        step += step_add
-                        
-
-            self.stop_record()
-
-        # Save to file
-        print("Loading to GUI...")
-        qimage = QImage(OUTPUT_FN)
-        qimage_safe = qimage.copy()
-        
         print("Finished!")
-        self.finished.emit(qimage_safe)
+        self.finished.emit(qimage)
+
+
+    def write_outputs(self, *args):
+        """write_images on the writer thread, keeping its exception for generate."""
+        try:
+            self.write_images(*args)
+        except BaseException as error:
+            self.write_error = error
+
+
+    def write_images(self, levels, colors, nmap, pixel_size, normals=None, cancel=None):
+        outputs = [(levels, NOISE_FN), (colors, self.params['output'])]
+        if self.params['heightmap'] is not None:
+            if pixel_size > 1:
+                nmap = lib.upscale_blocks(nmap, pixel_size, self.w, self.h)
+            outputs.append((nmap, self.params['heightmap']))
+        if normals is not None:
+            if pixel_size > 1:
+                normals = lib.upscale_blocks(normals, pixel_size, self.w, self.h)
+            outputs.append((normals, NORMAL_FN))
+
+        lib.save_outputs(outputs, compress_level=self.params['compress_level'],
+                         workers=self.params['workers'], cancel=cancel, telemetry=self.telemetry)
+
+        if self.w * self.h > PYRAMID_PIXELS:
+            self.export_pyramid(colors, cancel)
+
+
+    def export_pyramid(self, colors, cancel=None):
+        print("Exporting tiles...")
+        shutil.rmtree(PYRAMID_DIR, ignore_errors=True)
+        with self.telemetry.stage("pyramid", colors.shape[0] * colors.shape[1]):
+            lib.export_pyramid(colors, PYRAMID_DIR, workers=self.params['workers'], cancel=cancel,
+                               progress=self.stage_progress("Exporting tiles"))
+        self.pyramid_ready.emit(PYRAMID_DIR)
 
 
 class TerrainWidget(QWidget):
     """Widget for editing a single terrain type"""
+    changed = pyqtSignal()
+
     def __init__(self, terrain_data, index):
         super().__init__()
         self.index = index
@@ -260,6 +553,9 @@ class TerrainWidget(QWidget):
         
         self.setLayout(layout)
         self.update_color_preview()
+
+        for spin in (self.level_spin, self.variation_spin, self.r_spin, self.g_spin, self.b_spin):
+            spin.valueChanged.connect(self.changed)
         
     def update_color_preview(self):
         r = self.r_spin.value()
@@ -290,55 +586,29 @@ class TerrainWidget(QWidget):
 class MainWindow(QMainWindow):
     def __init__(self):
         super().__init__()
-        self.terrains = [
-            {
-                "name": "Abyss",
-                "level": 60,
-                "base": [15, 20, 30]  # Very dark, almost black blue
-            },
-            {
-                "name": "Deep Sea",
-                "level": 90,
-                "base": [30, 45, 60]  # Desaturated dark slate
-            },
-            {
-                "name": "Shallows",
-                "level": 105,
-                "base": [50, 70, 80]  # Muted teal-grey
-            },
-            {
-                "name": "Silt & Clay",
-                "level": 115,
-                "base": [100, 95, 85]  # Pallid, greyish beige (no bright yellow)
-            },
-            {
-                "name": "Dead Grass",
-                "level": 135,
-                "base": [85, 90, 70]  # Pale olive/drab
-            },
-            {
-                "name": "Deep Woods",
-                "level": 165,
-                "base": [45, 60, 50]  # Dark, desaturated pine green
-            },
-            {
-                "name": "Stone",
-                "level": 195,
-                "base": [60, 60, 65]  # Dark slate grey
-            },
-            {
-                "name": "Peaks",
-                "level": 225,
-                "base": [100, 100, 110] # Cold, lighter grey
-            },
-            {
-                "name": "Glacier",
-                "level": 256,
-                "base": [180, 190, 200] # Dirty/Muted white
-            }
-        ]
+        self.terrains = copy.deepcopy(lib.DEFAULT_TERRAINS)
         self.worker = None
+        self.generating = False
+        self.pending_regeneration = False
+        self.layer_cache = cache.LayerCache(LAYER_CACHE_BYTES)
+        self.surface_cache = cache.SurfaceCache(SURFACE_CACHE_BYTES)
+        self.noise_cache = cache.NoiseCache(NOISE_CACHE_BYTES, NOISE_CACHE_DIR,
+                                            generator=self.layer_cache.generate_noise_map)
         self.setup_ui()
+
+        # Live mode regenerates once the parameters stop changing
+        self.regen_timer = QTimer(self)
+        self.regen_timer.setSingleShot(True)
+        self.regen_timer.setInterval(LIVE_DEBOUNCE_MS)
+        self.regen_timer.timeout.connect(self.regenerate)
+
+        for spin in (self.w_spin, self.h_spin, self.scale_spin, self.octaves_spin, self.persistence_spin,
+                     self.lacunarity_spin, self.variation_spin, self.seed_spin, self.pixel_size_spin,
+                     self.pixelation_levels_spin, self.erosion_spin, self.shade_spin, self.exaggeration_spin,
+                     self.azimuth_spin, self.altitude_spin):
+            spin.valueChanged.connect(self.schedule_regeneration)
+        self.erosion_combo.currentIndexChanged.connect(self.schedule_regeneration)
+        self.normal_checkbox.stateChanged.connect(self.schedule_regeneration)
         
     def setup_ui(self):
         self.setWindowTitle("Terrain Generator")
@@ -390,18 +660,147 @@ class MainWindow(QMainWindow):
         self.octaves_spin.setRange(1, 16)
         self.octaves_spin.setValue(8)
         params_layout.addRow("Octaves:", self.octaves_spin)
+
+        # Persistence
+        self.persistence_spin = QDoubleSpinBox()
+        self.persistence_spin.setRange(0.05, 1.0)
+        self.persistence_spin.setValue(0.5)
+        self.persistence_spin.setSingleStep(0.05)
+        params_layout.addRow("Persistence:", self.persistence_spin)
+
+        # Lacunarity
+        self.lacunarity_spin = QDoubleSpinBox()
+        self.lacunarity_spin.setRange(1.0, 4.0)
+        self.lacunarity_spin.setValue(2.0)
+        self.lacunarity_spin.setSingleStep(0.1)
+        params_layout.addRow("Lacunarity:", self.lacunarity_spin)
         
         # Variation
         self.variation_spin = QSpinBox()
         self.variation_spin.setRange(0, 255)
         self.variation_spin.setValue(255)
         params_layout.addRow("Variation:", self.variation_spin)
+
+        # Pixelation: block size in pixels and number of height levels
+        pixel_layout = QHBoxLayout()
+        self.pixel_size_spin = QSpinBox()
+        self.pixel_size_spin.setRange(1, MAX_PIXEL_SIZE)
+        self.pixel_size_spin.setValue(1)
+        self.pixel_size_spin.setSpecialValueText("Off")
+        self.pixel_size_spin.setPrefix("Size ")
+        pixel_layout.addWidget(self.pixel_size_spin)
+
+        self.pixelation_levels_spin = QSpinBox()
+        self.pixelation_levels_spin.setRange(0, 256)
+        self.pixelation_levels_spin.setValue(0)
+        self.pixelation_levels_spin.setSpecialValueText("Off")
+        self.pixelation_levels_spin.setPrefix("Levels ")
+        pixel_layout.addWidget(self.pixelation_levels_spin)
+        params_layout.addRow("Pixelation:", pixel_layout)
+
+        # Erosion iterations and kind
+        erosion_layout = QHBoxLayout()
+        self.erosion_spin = QSpinBox()
+        self.erosion_spin.setRange(0, MAX_EROSION_ITERATIONS)
+        self.erosion_spin.setValue(0)
+        self.erosion_spin.setSingleStep(10)
+        self.erosion_spin.setSpecialValueText("Off")
+        self.erosion_spin.setToolTip("Erosion iterations")
+        erosion_layout.addWidget(self.erosion_spin)
+        self.erosion_combo = QComboBox()
+        self.erosion_combo.addItems(EROSION_MODES)
+        erosion_layout.addWidget(self.erosion_combo)
+        params_layout.addRow("Erosion:", erosion_layout)
+
+        # Hillshade blended into the colors and normal map export
+        shading_layout = QHBoxLayout()
+        self.shade_spin = QDoubleSpinBox()
+        self.shade_spin.setRange(0.0, 1.0)
+        self.shade_spin.setSingleStep(0.1)
+        self.shade_spin.setValue(0.0)
+        self.shade_spin.setSpecialValueText("Off")
+        self.shade_spin.setToolTip("Hillshade strength")
+        shading_layout.addWidget(self.shade_spin)
+        self.exaggeration_spin = QDoubleSpinBox()
+        self.exaggeration_spin.setRange(0.01, MAX_EXAGGERATION)
+        self.exaggeration_spin.setSingleStep(0.05)
+        self.exaggeration_spin.setValue(lib.RELIEF_EXAGGERATION)
+        self.exaggeration_spin.setToolTip("Relief height as a share of the map size")
+        shading_layout.addWidget(self.exaggeration_spin)
+
+        # Light direction, only relights the cached slopes
+        self.azimuth_spin = QSpinBox()
+        self.azimuth_spin.setRange(0, 359)
+        self.azimuth_spin.setWrapping(True)
+        self.azimuth_spin.setSingleStep(15)
+        self.azimuth_spin.setValue(int(lib.SUN_AZIMUTH))
+        self.azimuth_spin.setSuffix("°")
+        self.azimuth_spin.setToolTip("Sun azimuth, clockwise from the top of the map")
+        shading_layout.addWidget(self.azimuth_spin)
+        self.altitude_spin = QSpinBox()
+        self.altitude_spin.setRange(1, 90)
+        self.altitude_spin.setSingleStep(5)
+        self.altitude_spin.setValue(int(lib.SUN_ALTITUDE))
+        self.altitude_spin.setSuffix("°")
+        self.altitude_spin.setToolTip("Sun altitude above the horizon")
+        shading_layout.addWidget(self.altitude_spin)
+
+        self.normal_checkbox = QCheckBox("Normals")
+        self.normal_checkbox.setToolTip(f"Also write the normal map {NORMAL_FN}")
+        shading_layout.addWidget(self.normal_checkbox)
+        params_layout.addRow("Shading:", shading_layout)
         
         # Seed
         self.seed_spin = QSpinBox()
         self.seed_spin.setRange(SEED_MIN, SEED_MAX)
         self.seed_spin.setValue(random.randint(SEED_MIN, SEED_MAX))
         params_layout.addRow("Seed:", self.seed_spin)
+
+        # Workers and noise backend. auto keeps the NumPy octave layers for
+        # reuse, other backends regenerate every octave
+        workers_layout = QHBoxLayout()
+        self.workers_spin = QSpinBox()
+        self.workers_spin.setRange(1, MAX_WORKERS)
+        self.workers_spin.setValue(MAX_WORKERS)
+        workers_layout.addWidget(self.workers_spin)
+        self.backend_combo = QComboBox()
+        self.backend_combo.addItems(["auto"] + lib.available_backends())
+        self.backend_combo.setToolTip("Noise backend, auto reuses NumPy octave layers between runs")
+        workers_layout.addWidget(self.backend_combo)
+        params_layout.addRow("Workers:", workers_layout)
+
+        # Tile size (rows per worker task)
+        self.tile_size_spin = QSpinBox()
+        self.tile_size_spin.setRange(0, MAX_TERRAIN_SIZE)
+        self.tile_size_spin.setValue(0)
+        self.tile_size_spin.setSingleStep(64)
+        self.tile_size_spin.setSpecialValueText("Auto")
+        params_layout.addRow("Tile Rows:", self.tile_size_spin)
+
+        # Time-evolving animation written after the map
+        self.animation_spin = QSpinBox()
+        self.animation_spin.setRange(0, MAX_ANIMATION_FRAMES)
+        self.animation_spin.setValue(0)
+        self.animation_spin.setSingleStep(30)
+        self.animation_spin.setSuffix(" frames")
+        self.animation_spin.setSpecialValueText("Off")
+        self.animation_spin.setToolTip(f"Write {ANIMATION_FN}, the terrain evolving through time")
+        params_layout.addRow("Animation:", self.animation_spin)
+
+        # Output formats and PNG compression
+        output_layout = QHBoxLayout()
+        self.output_combo = QComboBox()
+        self.output_combo.addItems(OUTPUT_FORMATS)
+        output_layout.addWidget(self.output_combo)
+        self.heightmap_combo = QComboBox()
+        self.heightmap_combo.addItems(HEIGHTMAP_FORMATS)
+        output_layout.addWidget(self.heightmap_combo)
+        self.compress_spin = QSpinBox()
+        self.compress_spin.setRange(0, 9)
+        self.compress_spin.setValue(DEFAULT_COMPRESS_LEVEL)
+        self.compress_spin.setToolTip("PNG compression, 0 is fastest and 9 smallest")
+        output_layout.addWidget(self.compress_spin)
+        params_layout.addRow("Output:", output_layout)
         
         # Random seed button
         self.random_seed_btn = QPushButton("Random Seed")
@@ -425,6 +824,7 @@ class MainWindow(QMainWindow):
         self.terrain_widgets = []
         for i, terrain in enumerate(self.terrains):
             widget = TerrainWidget(terrain, i)
+            widget.changed.connect(self.schedule_regeneration)
             self.terrain_widgets.append(widget)
             self.terrain_layout.addWidget(widget)
         
@@ -450,14 +850,29 @@ class MainWindow(QMainWindow):
 
         self.generate_btn = QPushButton("Generate Terrain")
         self.generate_btn.setFont(QFont("Arial", 12, QFont.Weight.Bold))
-        self.generate_btn.clicked.connect(self.generate_terrain)
+        self.generate_btn.clicked.connect(self.on_generate_clicked)
         generate_layout.addWidget(self.generate_btn)
 
+        # Preview checkbox
+        self.preview_checkbox = QCheckBox("Preview")
+        self.preview_checkbox.setChecked(True)
+        generate_layout.addWidget(self.preview_checkbox)
+
+        # Live checkbox
+        self.live_checkbox = QCheckBox("Live")
+        generate_layout.addWidget(self.live_checkbox)
+
         # Record checkbox
         self.record_checkbox = QCheckBox("Record")
         self.record_checkbox.stateChanged.connect(self.toggle_record)
         generate_layout.addWidget(self.record_checkbox)
 
+        # Profile checkbox
+        self.profile_checkbox = QCheckBox("Profile")
+        self.profile_checkbox.setToolTip(f"Run stages under cProfile and write {TELEMETRY_FN}, "
+                                         f"{TRACE_FN} and {PROFILE_DIR}/")
+        generate_layout.addWidget(self.profile_checkbox)
+
         left_layout.addLayout(generate_layout)
         
         # Progress label
@@ -470,6 +885,12 @@ class MainWindow(QMainWindow):
         self.image_info.setAlignment(Qt.AlignmentFlag.AlignCenter)
         left_layout.addWidget(self.image_info)
 
+        # Stage timings of the last run
+        self.telemetry_label = QLabel()
+        self.telemetry_label.setFont(QFont("Monospace", 8))
+        self.telemetry_label.setTextInteractionFlags(Qt.TextInteractionFlag.TextSelectableByMouse)
+        left_layout.addWidget(self.telemetry_label)
+
         # Add left panel to main layout
         main_layout.addWidget(left_panel)
         
@@ -478,9 +899,7 @@ class MainWindow(QMainWindow):
         right_layout = QVBoxLayout(right_panel)
         
         # Image display
-        self.image_label = QLabel()
-        self.image_label.setAlignment(Qt.AlignmentFlag.AlignCenter)
-        self.image_label.setStyleSheet("border: 2px solid #cccccc; background-color: #000000; color;")
+        self.image_label = TileViewer()
         self.image_label.setText("Terrain will be displayed here")
         self.image_label.setMinimumSize(768, 768)
         self.image_label.setMaximumSize(768, 768)
@@ -504,6 +923,7 @@ class MainWindow(QMainWindow):
         }
         self.terrains.append(new_terrain)
         widget = TerrainWidget(new_terrain, len(self.terrains) - 1)
+        widget.changed.connect(self.schedule_regeneration)
         self.terrain_widgets.append(widget)
         self.terrain_layout.addWidget(widget)
         
@@ -522,11 +942,36 @@ class MainWindow(QMainWindow):
         terrains.sort(key=lambda x: x['level'])
         return terrains
         
+    def on_generate_clicked(self):
+        if self.generating:
+            self.pending_regeneration = False
+            self.worker.requestInterruption()
+            self.generate_btn.setEnabled(False)
+            self.generate_btn.setText("Cancelling...")
+        else:
+            self.generate_terrain()
+
+    def schedule_regeneration(self):
+        if self.live_checkbox.isChecked():
+            self.regen_timer.start()
+
+    def regenerate(self):
+        """Start a new generation, preempting the one in flight."""
+        if self.generating:
+            self.pending_regeneration = True
+            self.worker.requestInterruption()
+        else:
+            self.generate_terrain()
+
     def generate_terrain(self):
-        # Disable generate button during generation
-        self.generate_btn.setEnabled(False)
-        self.generate_btn.setText("Generating...")
+        # The generate button cancels while generating
+        self.generating = True
+        self.generate_btn.setText("Cancel")
         self.progress_label.setText("Generating noise map...")
+
+        # The previous worker has emitted its last signal, let it return
+        if self.worker is not None:
+            self.worker.wait()
         
         # Get parameters
         params = {
@@ -534,18 +979,43 @@ class MainWindow(QMainWindow):
             'h': self.h_spin.value(),
             'scale': self.scale_spin.value(),
             'octaves': self.octaves_spin.value(),
+            'persistence': self.persistence_spin.value(),
+            'lacunarity': self.lacunarity_spin.value(),
             'variation': self.variation_spin.value(),
+            'pixel_size': self.pixel_size_spin.value(),
+            'pixelation_levels': self.pixelation_levels_spin.value(),
+            'erosion_iterations': self.erosion_spin.value(),
+            'erosion_mode': self.erosion_combo.currentText(),
+            'shade_strength': self.shade_spin.value(),
+            'exaggeration': self.exaggeration_spin.value(),
+            'sun_azimuth': self.azimuth_spin.value(),
+            'sun_altitude': self.altitude_spin.value(),
+            'normal_map': self.normal_checkbox.isChecked(),
+            'output': OUTPUT_FORMATS[self.output_combo.currentText()],
+            'heightmap': HEIGHTMAP_FORMATS[self.heightmap_combo.currentText()],
+            'compress_level': self.compress_spin.value(),
             'seed': self.seed_spin.value(),
-            'record': self.record
+            'workers': self.workers_spin.value(),
+            'tile_size': self.tile_size_spin.value(),
+            'backend': self.backend_combo.currentText(),
+            'record': self.record,
+            'animation_frames': self.animation_spin.value(),
+            'preview': self.preview_checkbox.isChecked(),
+            'profile': self.profile_checkbox.isChecked()
         }
         
         # Get terrains
         terrains = self.get_current_terrains()
         
         # Create and start worker thread
-        self.worker = TerrainWorker(params, terrains)
+        self.worker = TerrainWorker(params, terrains, self.noise_cache, self.surface_cache)
         self.worker.progress.connect(self.update_progress)
+        self.worker.preview.connect(self.on_preview)
+        self.worker.rendered.connect(self.on_rendered)
+        self.worker.pyramid_ready.connect(self.image_label.set_pyramid)
         self.worker.finished.connect(self.on_generation_finished)
+        self.worker.cancelled.connect(self.on_generation_cancelled)
+        self.worker.failed.connect(self.on_generation_failed)
         self.worker.start()
 
     def update_progress(self, current, total, time_elapsed, text):
@@ -555,38 +1025,68 @@ class MainWindow(QMainWindow):
         progress_str += f"\n{current}/{total}"
         self.progress_label.setText(progress_str)
         
+    def show_image(self, qimage):
+        # Previews and subsampled images are stretched over the whole map
+        self.image_label.set_image(qimage, (self.worker.w, self.worker.h))
+
+    def on_rendered(self, qimage):
+        with self.worker.telemetry.stage("gui_load", qimage.width() * qimage.height()):
+            self.show_image(qimage)
+
+    def on_preview(self, qimage, step):
+        self.show_image(qimage)
+        self.image_info.setText(f"Preview 1/{step} resolution")
+
     def on_generation_finished(self, qimage):
-        # Display the image
-        pixmap = QPixmap.fromImage(qimage)
-        scaled_pixmap = pixmap.scaled(
-            self.image_label.size(),
-            Qt.AspectRatioMode.KeepAspectRatio,
-            Qt.TransformationMode.FastTransformation
-        )
-        self.image_label.setPixmap(scaled_pixmap)
-        
+        # The image was already displayed on rendered
         # Update info
         w = self.w_spin.value()
         h = self.h_spin.value()
-        self.image_info.setText(f"Size: {w}×{h} (displayed scaled)")
+        layers_mb = self.layer_cache.bytes / (1 << 20)
+        self.image_info.setText(f"Size: {w}×{h} (displayed scaled)\nOctave layer cache: {layers_mb:.1f} MB")
         
+        self.generation_done()
+        total_time = time.time() - self.worker.start_time
+        timing = f"Total: {total_time:.2f}s"
+        if self.worker.first_preview_time is not None:
+            timing = f"First preview: {self.worker.first_preview_time:.2f}s - " + timing
+        self.progress_label.setText(f"Generation complete!\n{timing}")
+        self.show_telemetry(self.worker.telemetry)
+
+        if self.pending_regeneration:
+            self.pending_regeneration = False
+            self.generate_terrain()
+
+    def on_generation_cancelled(self):
+        self.generation_done()
+        self.progress_label.setText("Cancelled")
+
+        if self.pending_regeneration:
+            self.pending_regeneration = False
+            self.generate_terrain()
+
+    def on_generation_failed(self, message):
+        self.generation_done()
+        self.progress_label.setText(f"Failed: {message}")
+
+        if self.pending_regeneration:
+            self.pending_regeneration = False
+            self.generate_terrain()
+
+    def show_telemetry(self, telemetry):
+        self.telemetry_label.setText(telemetry.format_table())
+
+        if telemetry.profile:
+            telemetry.save_json(TELEMETRY_FN)
+            telemetry.save_chrome_trace(TRACE_FN)
+            telemetry.save_profiles(PROFILE_DIR)
+            print(f"Telemetry written to {TELEMETRY_FN}, {TRACE_FN} and {PROFILE_DIR}/")
+
+    def generation_done(self):
         # Re-enable buttons
+        self.generating = False
         self.generate_btn.setEnabled(True)
         self.generate_btn.setText("Generate Terrain")
-        self.progress_label.setText("Generation complete!")
-        
-        
-    def resizeEvent(self, event):
-        """Handle window resize to scale image appropriately"""
-        super().resizeEvent(event)
-        if hasattr(self.image_label, 'pixmap') and self.image_label.pixmap():
-            pixmap = self.image_label.pixmap()
-            scaled_pixmap = pixmap.scaled(
-                self.image_label.size(),
-                Qt.AspectRatioMode.KeepAspectRatio,
-                Qt.TransformationMode.SmoothTransformation
-            )
-            self.image_label.setPixmap(scaled_pixmap)
 
 
 def main():
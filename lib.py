@@ -1,49 +1,995 @@
+import json
+import os
+import queue
+import struct
+import threading
+import time
+import zlib
+from contextlib import nullcontext
 import PIL
 from PIL import Image, ImageDraw
 import numpy as np
-from noise import snoise2
+
+DEFAULT_TERRAINS = [
+    {
+        "name": "Abyss",
+        "level": 60,
+        "base": [15, 20, 30]  # Very dark, almost black blue
+    },
+    {
+        "name": "Deep Sea",
+        "level": 90,
+        "base": [30, 45, 60]  # Desaturated dark slate
+    },
+    {
+        "name": "Shallows",
+        "level": 105,
+        "base": [50, 70, 80]  # Muted teal-grey
+    },
+    {
+        "name": "Silt & Clay",
+        "level": 115,
+        "base": [100, 95, 85]  # Pallid, greyish beige (no bright yellow)
+    },
+    {
+        "name": "Dead Grass",
+        "level": 135,
+        "base": [85, 90, 70]  # Pale olive/drab
+    },
+    {
+        "name": "Deep Woods",
+        "level": 165,
+        "base": [45, 60, 50]  # Dark, desaturated pine green
+    },
+    {
+        "name": "Stone",
+        "level": 195,
+        "base": [60, 60, 65]  # Dark slate grey
+    },
+    {
+        "name": "Peaks",
+        "level": 225,
+        "base": [100, 100, 110] # Cold, lighter grey
+    },
+    {
+        "name": "Glacier",
+        "level": 256,
+        "base": [180, 190, 200] # Dirty/Muted white
+    }
+]
+
+
+# Default minimum seconds between two progress callbacks, see throttle
+PROGRESS_INTERVAL = 0.1
+# Uncompressed bytes per PNG band deflated as one task by save_outputs
+PNG_BAND_BYTES = 4 << 20
+# Default light of hillshade, degrees clockwise from north and above the horizon
+SUN_AZIMUTH = 315.0
+SUN_ALTITUDE = 45.0
+# Height of the whole [0, 1] noise range as a share of the map's longest side
+RELIEF_EXAGGERATION = 0.1
+SHADE_STRENGTH = 0.6
+
+
+class Cancelled(Exception):
+    """Raised by long running functions when their cancel callback returns True."""
+
+
+def check_cancel(cancel):
+    """Cancellation checkpoint, cancel is a callable or None."""
+    if cancel is not None and cancel():
+        raise Cancelled()
+
+
+def throttle(progress, min_interval=PROGRESS_INTERVAL):
+    """Wrap a progress(done, total, ...) callback to fire at most every min_interval seconds.
+
+    The final call (done >= total) always goes through and extra arguments
+    are passed along. Returns None for a None callback, so the result can be
+    passed straight to lib functions.
+    """
+    if progress is None:
+        return None
+
+    last = -float("inf")
+
+    def throttled(done, total, *args):
+        nonlocal last
+        now = time.monotonic()
+        if done >= total or now - last >= min_interval:
+            last = now
+            progress(done, total, *args)
+
+    return throttled
+
+
+def _wait_tasks(tasks, cancel=None, progress=None, sizes=None):
+    """Wait for pool tasks, re-raising errors and honouring cancel.
+
+    progress(done, total) is called as tasks finish, counting sizes[i] work
+    units for tasks[i] (1 each by default).
+    """
+    from concurrent.futures import ALL_COMPLETED, FIRST_COMPLETED, wait
+
+    if sizes is None:
+        sizes = [1] * len(tasks)
+    size_of = dict(zip(tasks, sizes))
+    total = sum(sizes)
+    completed = 0
+
+    pending = set(tasks)
+    while pending:
+        done, pending = wait(pending, timeout=None if cancel is None else 0.1,
+                             return_when=ALL_COMPLETED if progress is None else FIRST_COMPLETED)
+        for task in done:
+            task.result()
+            completed += size_of[task]
+
+        if progress is not None and done:
+            progress(completed, total)
+
+        if cancel is not None and cancel():
+            for task in pending:
+                task.cancel()
+            raise Cancelled()
+
+
+def _stage(telemetry, name, pixels=None):
+    """telemetry.stage(name, pixels), or a no-op without telemetry."""
+    if telemetry is None:
+        return nullcontext()
+    return telemetry.stage(name, pixels)
+
+
+def load_terrains(path=None):
+    """Terrains from a JSON list (name, level, base[, variation]), sorted by level."""
+    if path is None:
+        return DEFAULT_TERRAINS
+
+    with open(path) as f:
+        terrains = json.load(f)
+
+    return sorted(terrains, key=lambda t: t["level"])
+
 
 def create_image(width, height, color):
-    """Create a new image with the specified width, height, and color."""
+    """Create a new image with the specified width, height, and color.
+
+    Kept for compatibility, use array_to_image to render whole maps.
+    """
     return Image.new("RGB", (width, height), color)
 
 
 def draw_pixel(image, x, y, color):
-    """Draw a pixel on the image at the specified coordinates."""
+    """Draw a pixel on the image at the specified coordinates.
+
+    Kept for compatibility, use array_to_image to render whole maps.
+    """
     draw = ImageDraw.Draw(image)
     draw.point((x, y), fill=color)
     return image
 
-def generate_noise_map(width, height, scale=100.0, octaves=6, persistence=0.5, lacunarity=2.0, seed=0):
+
+def array_to_image(array):
+    """Wrap a (h, w) grayscale or (h, w, 3) RGB uint8 array as a PIL image.
+
+    Grayscale arrays are shared with the image without copying, RGB is
+    unpacked by PIL in a single pass.
+    """
+    return Image.fromarray(np.ascontiguousarray(array, dtype=np.uint8))
+
+
+def save_array(array, filename, **kwargs):
+    """Render an array with array_to_image and write it to filename.
+
+    A .npy filename gets the raw array instead: uncompressed, and loadable
+    without decoding with np.load(filename, mmap_mode="r").
+    """
+    if filename.endswith(".npy"):
+        np.save(filename, array)
+        return None
+
+    image = array_to_image(array)
+    image.save(filename, **kwargs)
+    return image
+
+
+def save_heightmap(noise_map, filename, **kwargs):
+    """Write a normalized noise map at full precision.
+
+    .npy files hold float32 values in [0, 1]; .png, .tif and .tiff files
+    16-bit grayscale with 65535 for 1.0.
+    """
+    if filename.endswith(".npy"):
+        np.save(filename, noise_map.astype(np.float32, copy=False))
+        return
+
+    heights = (noise_map * 65535).astype(np.uint16)
+    Image.fromarray(heights).save(filename, **kwargs)
+
+
+def _png_chunk(file, kind, data):
+    file.write(struct.pack(">I", len(data)))
+    file.write(kind)
+    file.write(data)
+    file.write(struct.pack(">I", zlib.crc32(data, zlib.crc32(kind))))
+
+
+def _adler32_combine(adler1, adler2, length2):
+    """Adler-32 of two concatenated buffers from their own checksums (zlib's adler32_combine)."""
+    base = 65521
+    rem = length2 % base
+    sum1 = adler1 & 0xffff
+    sum2 = rem * sum1 % base
+    sum1 += (adler2 & 0xffff) + base - 1
+    sum2 += ((adler1 >> 16) & 0xffff) + ((adler2 >> 16) & 0xffff) + base - rem
+    if sum1 >= base:
+        sum1 -= base
+    if sum1 >= base:
+        sum1 -= base
+    if sum2 >= base << 1:
+        sum2 -= base << 1
+    if sum2 >= base:
+        sum2 -= base
+    return sum1 | (sum2 << 16)
+
+
+def _deflate_band(rows, row_start, row_end, compress_level, last):
+    """Raw deflate of the Up-filtered PNG scanlines [row_start, row_end) of (h, bytes) rows."""
+    band = rows[row_start:row_end]
+    scanlines = np.empty((len(band), rows.shape[1] + 1), dtype=np.uint8)
+    scanlines[:, 0] = 2  # Up filter, each byte minus the one above
+    scanlines[:, 1:] = band
+    scanlines[1:, 1:] -= band[:-1]
+    if row_start > 0:
+        scanlines[0, 1:] -= rows[row_start - 1]
+
+    data = scanlines.tobytes()
+    compressor = zlib.compressobj(compress_level, zlib.DEFLATED, -15)
+    deflated = compressor.compress(data) + compressor.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+    return deflated, zlib.adler32(data), len(data)
+
+
+def _png_encoder(array, compress_level, pool):
+    """Start deflating a PNG of array on pool, returns write(filename) finishing it.
+
+    array is (h, w) or (h, w, 3) uint8, or (h, w) uint16 for 16-bit
+    grayscale. Row bands are deflated independently and joined into one
+    zlib stream, like pigz, so a single image uses every pool thread.
+    """
+    height, width = array.shape[:2]
+    color_type = 2 if array.ndim == 3 else 0
+    bit_depth = 16 if array.dtype == np.uint16 else 8
+    if bit_depth == 16:
+        array = array.astype(">u2")
+    rows = np.ascontiguousarray(array).view(np.uint8).reshape(height, -1)
+
+    band_rows = max(1, PNG_BAND_BYTES // rows.shape[1])
+    tasks = [pool.submit(_deflate_band, rows, row, min(height, row + band_rows), compress_level,
+                         row + band_rows >= height)
+             for row in range(0, height, band_rows)]
+
+    def write(filename):
+        adler = 1
+        with open(filename, "wb") as f:
+            f.write(b"\x89PNG\r\n\x1a\n")
+            _png_chunk(f, b"IHDR", struct.pack(">IIBBBBB", width, height, bit_depth, color_type, 0, 0, 0))
+            _png_chunk(f, b"IDAT", b"\x78\x9c")  # zlib header
+            for task in tasks:
+                deflated, band_adler, length = task.result()
+                adler = _adler32_combine(adler, band_adler, length)
+                _png_chunk(f, b"IDAT", deflated)
+            _png_chunk(f, b"IDAT", struct.pack(">I", adler))
+            _png_chunk(f, b"IEND", b"")
+
+    return write
+
+
+def save_outputs(outputs, compress_level=6, workers=None, cancel=None, telemetry=None):
+    """Write (array, filename) pairs concurrently on a thread pool.
+
+    uint8 arrays are images and float arrays normalized heightmaps, written
+    like save_array and save_heightmap. PNG files are deflated in row bands
+    spread over the pool, every other file is one pool task; zlib, PIL and
+    NumPy release the GIL while encoding. compress_level is the zlib level
+    of PNG files, 0 (stored, fastest) to 9 (smallest). With a
+    telemetry.Telemetry, each file is recorded as a stage named after it,
+    timed from the start of the call until it is written.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    start = time.perf_counter()
+
+    def record(array, filename):
+        if telemetry is not None:
+            telemetry.add(os.path.basename(filename), time.perf_counter() - start, start=start,
+                          pixels=array.shape[0] * array.shape[1])
+
+    def save(array, filename):
+        if array.dtype == np.uint8:
+            save_array(array, filename)
+        else:
+            save_heightmap(array, filename)
+        record(array, filename)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pngs = []
+        others = []
+        for array, filename in outputs:
+            if filename.lower().endswith(".png"):
+                image = array if array.dtype == np.uint8 else (array * 65535).astype(np.uint16)
+                pngs.append((array, filename, _png_encoder(image, compress_level, pool)))
+            else:
+                others.append(pool.submit(save, array, filename))
+
+        try:
+            for array, filename, write in pngs:
+                check_cancel(cancel)
+                write(filename)
+                record(array, filename)
+            _wait_tasks(others, cancel)
+        except BaseException:
+            pool.shutdown(cancel_futures=True)
+            raise
+
+
+# Permutation and gradient tables of the `noise` package (_noise.h), so the
+# vectorized kernel below reproduces snoise2 exactly.
+_PERM = np.array([
+    151, 160, 137, 91, 90, 15, 131, 13, 201, 95, 96, 53, 194, 233, 7, 225, 140,
+    36, 103, 30, 69, 142, 8, 99, 37, 240, 21, 10, 23, 190, 6, 148, 247, 120,
+    234, 75, 0, 26, 197, 62, 94, 252, 219, 203, 117, 35, 11, 32, 57, 177, 33,
+    88, 237, 149, 56, 87, 174, 20, 125, 136, 171, 168, 68, 175, 74, 165, 71,
+    134, 139, 48, 27, 166, 77, 146, 158, 231, 83, 111, 229, 122, 60, 211, 133,
+    230, 220, 105, 92, 41, 55, 46, 245, 40, 244, 102, 143, 54, 65, 25, 63, 161,
+    1, 216, 80, 73, 209, 76, 132, 187, 208, 89, 18, 169, 200, 196, 135, 130,
+    116, 188, 159, 86, 164, 100, 109, 198, 173, 186, 3, 64, 52, 217, 226, 250,
+    124, 123, 5, 202, 38, 147, 118, 126, 255, 82, 85, 212, 207, 206, 59, 227,
+    47, 16, 58, 17, 182, 189, 28, 42, 223, 183, 170, 213, 119, 248, 152, 2, 44,
+    154, 163, 70, 221, 153, 101, 155, 167, 43, 172, 9, 129, 22, 39, 253, 19, 98,
+    108, 110, 79, 113, 224, 232, 178, 185, 112, 104, 218, 246, 97, 228, 251, 34,
+    242, 193, 238, 210, 144, 12, 191, 179, 162, 241, 81, 51, 145, 235, 249, 14,
+    239, 107, 49, 192, 214, 31, 181, 199, 106, 157, 184, 84, 204, 176, 115, 121,
+    50, 45, 127, 4, 150, 254, 138, 236, 205, 93, 222, 114, 67, 29, 24, 72, 243,
+    141, 128, 195, 78, 66, 215, 61, 156, 180
+] * 2, dtype=np.int32)
+
+_GRAD2 = np.array([
+    [1, 1], [-1, 1], [1, -1], [-1, -1],
+    [1, 0], [-1, 0], [1, 0], [-1, 0],
+    [0, 1], [0, -1], [0, 1], [0, -1],
+], dtype=np.float32)
+
+_F2 = np.float32(0.3660254037844386)  # 0.5 * (sqrt(3.0) - 1.0)
+_G2 = np.float32(0.21132486540518713)  # (3.0 - sqrt(3.0)) / 6.0
+
+_GRAD3 = np.array([
+    [1, 1, 0], [-1, 1, 0], [1, -1, 0], [-1, -1, 0],
+    [1, 0, 1], [-1, 0, 1], [1, 0, -1], [-1, 0, -1],
+    [0, 1, 1], [0, -1, 1], [0, 1, -1], [0, -1, -1],
+], dtype=np.float32)
+
+_F3 = np.float32(1.0) / np.float32(3.0)
+_G3 = np.float32(1.0) / np.float32(6.0)
+
+# snoise2 base offset is seed / SEED_DIVISOR
+SEED_DIVISOR = 10
+
+# Defaults of the infinite world: noise distance between two pixels (the
+# GUI default scale over 1024 pixels) and the fixed normalization range,
+# which covers most fBm output, values beyond it are clipped
+WORLD_PIXEL_SIZE = 1.75 / 1024
+WORLD_VALUE_RANGE = (-0.7, 0.7)
+
+# Pixels evaluated per vectorized pass, keeps temporaries around a few MB
+BLOCK_PIXELS = 1 << 20
+
+
+def _simplex_corner(xx, yy, g):
+    f = np.float32(0.5) - xx * xx - yy * yy
+    n = f * f * f * f * (_GRAD2[g, 0] * xx + _GRAD2[g, 1] * yy)
+    return np.where(f > 0, n, np.float32(0))
+
+
+def simplex2(x, y):
+    """2D simplex noise over float32 arrays, equivalent to noise.snoise2 with one octave."""
+    s = (x + y) * _F2
+    i = np.floor(x + s)
+    j = np.floor(y + s)
+    t = (i + j) * _G2
+
+    xx0 = x - (i - t)
+    yy0 = y - (j - t)
+
+    i1 = xx0 > yy0
+    j1 = ~i1
+
+    xx1 = xx0 - i1 + _G2
+    yy1 = yy0 - j1 + _G2
+    xx2 = xx0 + _G2 * np.float32(2.0) - np.float32(1.0)
+    yy2 = yy0 + _G2 * np.float32(2.0) - np.float32(1.0)
+
+    ii = i.astype(np.int32) & 255
+    jj = j.astype(np.int32) & 255
+    g0 = _PERM[ii + _PERM[jj]] % 12
+    g1 = _PERM[ii + i1 + _PERM[jj + j1]] % 12
+    g2 = _PERM[ii + 1 + _PERM[jj + 1]] % 12
+
+    total = _simplex_corner(xx0, yy0, g0)
+    total += _simplex_corner(xx1, yy1, g1)
+    total += _simplex_corner(xx2, yy2, g2)
+    return total * np.float32(70.0)
+
+
+def fbm2(x, y, octaves=6, persistence=0.5, lacunarity=2.0, base=0.0):
+    """Fractal sum of simplex octaves, same accumulation order as snoise2."""
+    persistence = np.float32(persistence)
+    lacunarity = np.float32(lacunarity)
+    base = np.float32(base)
+
+    freq = np.float32(1.0)
+    amp = np.float32(1.0)
+    max_amp = np.float32(1.0)
+    total = simplex2(x + base, y + base)
+
+    for _ in range(1, octaves):
+        freq *= lacunarity
+        amp *= persistence
+        max_amp += amp
+        total += simplex2(x * freq + base, y * freq + base) * amp
+
+    return total / max_amp
+
+
+def _simplex3_corner(xx, yy, zz, g):
+    f = np.float32(0.6) - xx * xx - yy * yy - zz * zz
+    n = f * f * f * f * (xx * _GRAD3[g, 0] + yy * _GRAD3[g, 1] + zz * _GRAD3[g, 2])
+    return np.where(f > 0, n, np.float32(0))
+
+
+def simplex3(x, y, z):
+    """3D simplex noise over float32 arrays, equivalent to noise.snoise3 with one octave."""
+    s = (x + y + z) * _F3
+    i = np.floor(x + s)
+    j = np.floor(y + s)
+    k = np.floor(z + s)
+    t = (i + j + k) * _G3
+
+    xx0 = x - (i - t)
+    yy0 = y - (j - t)
+    zz0 = z - (k - t)
+
+    # Offsets of the second and third corners, the branches of noise3 as masks
+    x_ge_y = xx0 >= yy0
+    y_ge_z = yy0 >= zz0
+    x_ge_z = xx0 >= zz0
+    i1 = x_ge_y & (y_ge_z | x_ge_z)
+    j1 = ~x_ge_y & y_ge_z
+    k1 = ~y_ge_z & ~(x_ge_y & x_ge_z)
+    i2 = x_ge_y | (y_ge_z & x_ge_z)
+    j2 = ~x_ge_y | y_ge_z
+    k2 = ~y_ge_z | ~(x_ge_y | x_ge_z)
+
+    xx1 = xx0 - i1 + _G3
+    yy1 = yy0 - j1 + _G3
+    zz1 = zz0 - k1 + _G3
+    xx2 = xx0 - i2 + np.float32(2.0) * _G3
+    yy2 = yy0 - j2 + np.float32(2.0) * _G3
+    zz2 = zz0 - k2 + np.float32(2.0) * _G3
+    xx3 = xx0 - np.float32(1.0) + np.float32(3.0) * _G3
+    yy3 = yy0 - np.float32(1.0) + np.float32(3.0) * _G3
+    zz3 = zz0 - np.float32(1.0) + np.float32(3.0) * _G3
+
+    ii = i.astype(np.int32) & 255
+    jj = j.astype(np.int32) & 255
+    kk = k.astype(np.int32) & 255
+    g0 = _PERM[ii + _PERM[jj + _PERM[kk]]] % 12
+    g1 = _PERM[ii + i1 + _PERM[jj + j1 + _PERM[kk + k1]]] % 12
+    g2 = _PERM[ii + i2 + _PERM[jj + j2 + _PERM[kk + k2]]] % 12
+    g3 = _PERM[ii + 1 + _PERM[jj + 1 + _PERM[kk + 1]]] % 12
+
+    total = _simplex3_corner(xx0, yy0, zz0, g0)
+    total += _simplex3_corner(xx1, yy1, zz1, g1)
+    total += _simplex3_corner(xx2, yy2, zz2, g2)
+    total += _simplex3_corner(xx3, yy3, zz3, g3)
+    return total * np.float32(32.0)
+
+
+def fbm3(x, y, z, octaves=6, persistence=0.5, lacunarity=2.0):
+    """Fractal sum of 3D simplex octaves, same accumulation order as snoise3."""
+    persistence = np.float32(persistence)
+    lacunarity = np.float32(lacunarity)
+
+    freq = np.float32(1.0)
+    amp = np.float32(1.0)
+    max_amp = np.float32(1.0)
+    total = simplex3(x, y, z)
+
+    for _ in range(1, octaves):
+        freq *= lacunarity
+        amp *= persistence
+        max_amp += amp
+        total += simplex3(x * freq, y * freq, z * freq) * amp
+
+    return total / max_amp
+
+
+def noise_coords(width, height, scale=100.0):
+    """Sample coordinates of the map columns and rows."""
     aspect_ratio = height / width
-    
+
     x = np.linspace(0, scale, width, endpoint=False)
     y = np.linspace(0, scale * aspect_ratio, height, endpoint=False)
-    
-    xv, yv = np.meshgrid(x, y)
-    
-    noise_map = np.zeros((height, width))
-    step = 0
-    seed_divisor = 10
-    for i in range(height):
-        for j in range(width):
-            step += 1
-            
-            noise_map[i, j] = snoise2(yv[i, j], xv[i, j],
-                                      octaves=octaves,
-                                      persistence=persistence,
-                                      lacunarity=lacunarity,
-                                      base=seed/seed_divisor)
-    
+
+    return x, y
+
+
+def noise_rows(x, y, row_start, row_end, octaves=6, persistence=0.5, lacunarity=2.0, seed=0,
+               backend="numpy"):
+    """Raw (not normalized) noise for rows [row_start, row_end) of the map.
+
+    backend names an entry of NOISE_BACKENDS, see resolve_backend.
+    """
+    rows_function, _ = NOISE_BACKENDS[backend]
+    return rows_function(x, y, row_start, row_end, octaves, persistence, lacunarity, seed)
+
+
+def _numpy_rows(x, y, row_start, row_end, octaves, persistence, lacunarity, seed):
+    # snoise2 is called as (row coordinate, column coordinate)
+    rows = y[row_start:row_end].astype(np.float32)[:, None]
+    cols = x.astype(np.float32)[None, :]
+    rows, cols = np.broadcast_arrays(rows, cols)
+
+    return fbm2(rows, cols,
+                octaves=octaves,
+                persistence=persistence,
+                lacunarity=lacunarity,
+                base=seed / SEED_DIVISOR)
+
+
+def _snoise_rows(x, y, row_start, row_end, octaves, persistence, lacunarity, seed):
+    """The `noise` C extension, one snoise2 call per pixel."""
+    from noise import snoise2
+
+    base = seed / SEED_DIVISOR
+    cols = x.astype(np.float32).tolist()
+    out = np.empty((row_end - row_start, len(x)), dtype=np.float32)
+    for i, row in enumerate(y[row_start:row_end].astype(np.float32).tolist()):
+        out[i] = [snoise2(row, col, octaves=octaves, persistence=persistence, lacunarity=lacunarity, base=base)
+                  for col in cols]
+    return out
+
+
+def _numba_rows(x, y, row_start, row_end, octaves, persistence, lacunarity, seed):
+    import numba_kernel
+
+    out = np.empty((row_end - row_start, len(x)), dtype=np.float32)
+    numba_kernel.fbm2_grid(y[row_start:row_end].astype(np.float32), x.astype(np.float32), octaves,
+                           np.float32(persistence), np.float32(lacunarity), np.float32(seed / SEED_DIVISOR),
+                           _PERM, _GRAD2, out)
+    return out
+
+
+# Noise backends: name -> (rows function, module it needs or None). A rows
+# function takes noise_rows' arguments and returns a float32 (rows, width)
+# array; the built-in ones all reproduce snoise2 exactly.
+NOISE_BACKENDS = {}
+# Overrides the automatic choice when set to a backend name
+NOISE_BACKEND_ENV = "SHAPEGEN_NOISE_BACKEND"
+BACKEND_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "shapegen", "noise_backends.json")
+# Bounds the micro-benchmark of select_backend
+BENCHMARK_ROWS = 8
+BENCHMARK_COLUMNS = 2048
+BENCHMARK_OCTAVES = 4
+_backend_choices = {}
+
+
+def register_backend(name, rows_function, module=None):
+    """Add a noise backend; module names an optional dependency it needs."""
+    NOISE_BACKENDS[name] = (rows_function, module)
+
+
+register_backend("numpy", _numpy_rows)
+register_backend("noise", _snoise_rows, module="noise")
+register_backend("numba", _numba_rows, module="numba")
+
+
+def available_backends():
+    """Registered backends whose dependencies are installed."""
+    from importlib.util import find_spec
+
+    return [name for name, (_, module) in NOISE_BACKENDS.items() if module is None or find_spec(module)]
+
+
+def benchmark_backends(width, backends=None):
+    """Seconds per pixel of every backend over a few rows of a map width wide."""
+    x, y = noise_coords(min(width, BENCHMARK_COLUMNS), BENCHMARK_ROWS * 2, 1.75)
+    timings = {}
+    for name in backends or available_backends():
+        # The first band pays for imports and JIT compilation
+        noise_rows(x, y, 0, 1, octaves=BENCHMARK_OCTAVES, backend=name)
+        start = time.perf_counter()
+        noise_rows(x, y, 1, 1 + BENCHMARK_ROWS, octaves=BENCHMARK_OCTAVES, backend=name)
+        timings[name] = (time.perf_counter() - start) / (BENCHMARK_ROWS * len(x))
+    return timings
+
+
+def resolve_backend(backend=None, width=1024, cache_path=BACKEND_CACHE_PATH):
+    """Backend name to use for maps width pixels wide.
+
+    An explicit backend other than "auto" wins, then the NOISE_BACKEND_ENV
+    environment variable. Otherwise the fastest available backend is picked
+    by benchmark_backends, once per width bucket (the next power of two)
+    and set of installed backends, and the choice is kept in cache_path so
+    later runs skip the benchmark. cache_path None disables the disk cache.
+    """
+    backend = backend or os.environ.get(NOISE_BACKEND_ENV) or "auto"
+    available = available_backends()
+    if backend != "auto":
+        if backend not in available:
+            raise ValueError(f"Noise backend {backend!r} is not available, choose from {', '.join(available)}")
+        return backend
+
+    key = f"{1 << max(0, width - 1).bit_length()}:{','.join(sorted(available))}"
+    if key in _backend_choices:
+        return _backend_choices[key]
+
+    choices = {}
+    if cache_path is not None:
+        try:
+            with open(cache_path) as f:
+                choices = json.load(f)
+        except (OSError, ValueError):
+            pass
+
+    choice = choices.get(key)
+    if choice not in available:
+        timings = benchmark_backends(width, available)
+        choice = min(timings, key=timings.get)
+        choices[key] = choice
+        if cache_path is not None:
+            try:
+                os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+                with open(cache_path, "w") as f:
+                    json.dump(choices, f, indent=2)
+            except OSError:
+                pass
+
+    _backend_choices[key] = choice
+    return choice
+
+
+def _octave_freq(octave, lacunarity):
+    """Frequency of an octave, accumulated in float32 like fbm2."""
+    freq = np.float32(1.0)
+    for _ in range(octave):
+        freq *= np.float32(lacunarity)
+    return freq
+
+
+def _layer_rows(x, y, row_start, row_end, octave, lacunarity, seed):
+    freq = _octave_freq(octave, lacunarity)
+    base = np.float32(seed / SEED_DIVISOR)
+
+    rows = y[row_start:row_end].astype(np.float32)[:, None]
+    cols = x.astype(np.float32)[None, :]
+    rows, cols = np.broadcast_arrays(rows, cols)
+
+    return simplex2(rows * freq + base, cols * freq + base)
+
+
+def _layer_tile(shm_name, shape, index, octave, row_start, row_end, x, y, lacunarity, seed):
+    """Process pool task: write one row band of one octave layer."""
+    from multiprocessing import shared_memory
+
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        out = np.ndarray(shape, dtype=np.float32, buffer=shm.buf)
+        out[index, row_start:row_end] = _layer_rows(x, y, row_start, row_end, octave, lacunarity, seed)
+        del out
+    finally:
+        shm.close()
+
+
+def octave_layers(x, y, octaves, lacunarity=2.0, seed=0, layers=None, workers=1, tile_size=None,
+                  cancel=None, progress=None):
+    """Unweighted simplex layer of every octave, (h, w) float32 each.
+
+    Layers already in `layers` are reused and only the missing octaves are
+    computed and appended to it, by a process pool when workers > 1. The
+    layers depend on the coordinates, lacunarity and seed but not on
+    persistence, see combine_layers. progress(rows, total) counts the rows
+    of every missing layer.
+    """
+    if layers is None:
+        layers = []
+    if tile_size is None or tile_size <= 0:
+        tile_size = max(1, BLOCK_PIXELS // len(x))
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    height, width = len(y), len(x)
+    missing = list(range(len(layers), octaves))
+    if not missing:
+        return layers
+
+    total = len(missing) * height
+    if workers <= 1:
+        for index, octave in enumerate(missing):
+            layer = np.empty((height, width), dtype=np.float32)
+            for row in range(0, height, tile_size):
+                check_cancel(cancel)
+                row_end = min(height, row + tile_size)
+                layer[row:row_end] = _layer_rows(x, y, row, row_end, octave, lacunarity, seed)
+                if progress is not None:
+                    progress(index * height + row_end, total)
+            layers.append(layer)
+        return layers
+
+    from concurrent.futures import ProcessPoolExecutor
+    from multiprocessing import shared_memory
+
+    shape = (len(missing), height, width)
+    shm = shared_memory.SharedMemory(create=True, size=int(np.prod(shape)) * np.dtype(np.float32).itemsize)
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            tasks = [
+                pool.submit(_layer_tile, shm.name, shape, index, octave, row, min(height, row + tile_size),
+                            x, y, lacunarity, seed)
+                for index, octave in enumerate(missing)
+                for row in range(0, height, tile_size)
+            ]
+            sizes = [min(tile_size, height - row) for _ in missing for row in range(0, height, tile_size)]
+            _wait_tasks(tasks, cancel, progress, sizes)
+
+        shared = np.ndarray(shape, dtype=np.float32, buffer=shm.buf)
+        layers.extend(layer.copy() for layer in shared)
+        del shared
+    finally:
+        shm.close()
+        shm.unlink()
+
+    return layers
+
+
+def combine_layers(layers, octaves, persistence=0.5):
+    """Weighted sum of the first octaves layers, the same result as fbm2."""
+    persistence = np.float32(persistence)
+
+    amp = np.float32(1.0)
+    max_amp = np.float32(1.0)
+    total = layers[0].copy()
+
+    for layer in layers[1:octaves]:
+        amp *= persistence
+        max_amp += amp
+        total += layer * amp
+
+    return total / max_amp
+
+
+def normalize_map(noise_map):
+    """Stretch the map to [0, 1] using its own min/max."""
     noise_min = noise_map.min()
     noise_max = noise_map.max()
-    
+
     if noise_max - noise_min > 0:
         noise_map = (noise_map - noise_min) / (noise_max - noise_min)
-    
+
     return noise_map
 
 
+def normalize_range(noise_map, value_range):
+    """Map a fixed (min, max) range to [0, 1], clipping values outside it."""
+    noise_min, noise_max = value_range
+
+    if noise_max - noise_min > 0:
+        noise_map = np.clip((noise_map - noise_min) / (noise_max - noise_min), 0.0, 1.0)
+
+    return noise_map
+
+
+def region_coords(x0, y0, width, height, pixel_size):
+    """Noise coordinates of a window of world pixels starting at (x0, y0).
+
+    Coordinates only depend on the absolute pixel, so adjacent windows
+    continue each other exactly.
+    """
+    x = (x0 + np.arange(width, dtype=np.float64)) * pixel_size
+    y = (y0 + np.arange(height, dtype=np.float64)) * pixel_size
+
+    return x, y
+
+
+def generate_region(x0, y0, width, height, pixel_size=WORLD_PIXEL_SIZE, octaves=6, persistence=0.5,
+                    lacunarity=2.0, seed=0, value_range=WORLD_VALUE_RANGE, cancel=None):
+    """Noise map of a (width, height) window of an infinite world at (x0, y0).
+
+    Unlike generate_noise_map the map is normalized with the fixed
+    value_range rather than its own min/max, so chunks rendered separately
+    tile seamlessly. pixel_size is the noise distance between two pixels.
+    """
+    x, y = region_coords(x0, y0, width, height, pixel_size)
+
+    noise_map = np.zeros((height, width))
+    band = max(1, BLOCK_PIXELS // width)
+    for row in range(0, height, band):
+        check_cancel(cancel)
+        row_end = min(height, row + band)
+        noise_map[row:row_end] = noise_rows(x, y, row, row_end,
+                                            octaves=octaves,
+                                            persistence=persistence,
+                                            lacunarity=lacunarity,
+                                            seed=seed)
+
+    return normalize_range(noise_map, value_range)
+
+
+def noise_frames(x, y, times, octaves=6, persistence=0.5, lacunarity=2.0, seed=0):
+    """Raw 3D noise of shape (len(times), len(y), len(x)), one frame per time.
+
+    The batch is computed as a (frames * rows, columns) map in bands of
+    BLOCK_PIXELS, so temporaries stay small however many frames are asked
+    for. Frame t is snoise3(row + base, column + base, times[t]), the seed
+    shifting the map the same way as the 2D base does.
+    """
+    width = len(x)
+    height = len(y)
+    base = np.float32(seed / SEED_DIVISOR)
+    rows = y.astype(np.float32) + base
+    cols = x.astype(np.float32)[None, :] + base
+    times = np.asarray(times, dtype=np.float32)
+
+    out = np.empty((len(times) * height, width), dtype=np.float32)
+    band = max(1, BLOCK_PIXELS // width)
+    for row in range(0, len(out), band):
+        row_end = min(len(out), row + band)
+        index = np.arange(row, row_end)
+        r, c, t = np.broadcast_arrays(rows[index % height][:, None], cols, times[index // height][:, None])
+        out[row:row_end] = fbm3(r, c, t, octaves=octaves, persistence=persistence, lacunarity=lacunarity)
+
+    return out.reshape(len(times), height, width)
+
+
+def _noise_tile(shm_name, shape, row_start, row_end, x, y, octaves, persistence, lacunarity, seed, backend):
+    """Process pool task: write one row band into the shared output array."""
+    from multiprocessing import shared_memory
+
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        out = np.ndarray(shape, dtype=np.float64, buffer=shm.buf)
+        out[row_start:row_end] = noise_rows(x, y, row_start, row_end,
+                                            octaves=octaves,
+                                            persistence=persistence,
+                                            lacunarity=lacunarity,
+                                            seed=seed,
+                                            backend=backend)
+        del out
+    finally:
+        shm.close()
+
+
+def generate_noise_map(width, height, scale=100.0, octaves=6, persistence=0.5, lacunarity=2.0, seed=0,
+                       workers=1, tile_size=None, layers=None, cancel=None, progress=None, telemetry=None,
+                       backend=None):
+    """Normalized noise map of shape (height, width).
+
+    workers > 1 splits the map into bands of tile_size rows computed in a
+    process pool (None uses every core). Rows are independent and the
+    min/max normalization runs after all bands finish, so the result is the
+    same as a single-process run.
+
+    With a `layers` list the map is built from per-octave layers instead
+    (see octave_layers): layers already in the list are reused, missing ones
+    are appended, and persistence only reweights them. The list must have
+    been filled for the same size, scale, lacunarity and seed. Layers are
+    always computed by the NumPy kernel, otherwise the noise comes from
+    resolve_backend(backend, width).
+
+    cancel is an optional callable polled between bands; once it returns
+    True, Cancelled is raised. progress(rows, total) is called as bands
+    finish, wrap it with throttle to rate-limit it. With a
+    telemetry.Telemetry, the normalization is timed as its own stage.
+    """
+    x, y = noise_coords(width, height, scale)
+
+    if layers is not None:
+        octave_layers(x, y, octaves, lacunarity=lacunarity, seed=seed, layers=layers,
+                      workers=workers, tile_size=tile_size, cancel=cancel, progress=progress)
+        noise_map = combine_layers(layers, octaves, persistence).astype(np.float64)
+        with _stage(telemetry, "normalize", width * height):
+            return normalize_map(noise_map)
+
+    backend = resolve_backend(backend, width)
+    if tile_size is None or tile_size <= 0:
+        tile_size = max(1, BLOCK_PIXELS // width)
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = min(workers, -(-height // tile_size))
+
+    if workers <= 1:
+        noise_map = np.zeros((height, width))
+        for row in range(0, height, tile_size):
+            check_cancel(cancel)
+            row_end = min(height, row + tile_size)
+            noise_map[row:row_end] = noise_rows(x, y, row, row_end,
+                                                octaves=octaves,
+                                                persistence=persistence,
+                                                lacunarity=lacunarity,
+                                                seed=seed,
+                                                backend=backend)
+            if progress is not None:
+                progress(row_end, height)
+        with _stage(telemetry, "normalize", width * height):
+            return normalize_map(noise_map)
+
+    # Imported here, the process pool machinery is slow to import
+    from concurrent.futures import ProcessPoolExecutor
+    from multiprocessing import shared_memory
+
+    shape = (height, width)
+    shm = shared_memory.SharedMemory(create=True, size=height * width * np.dtype(np.float64).itemsize)
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            tasks = [
+                pool.submit(_noise_tile, shm.name, shape, row, min(height, row + tile_size),
+                            x, y, octaves, persistence, lacunarity, seed, backend)
+                for row in range(0, height, tile_size)
+            ]
+            sizes = [min(tile_size, height - row) for row in range(0, height, tile_size)]
+            _wait_tasks(tasks, cancel, progress, sizes)
+
+        shared = np.ndarray(shape, dtype=np.float64, buffer=shm.buf)
+        with _stage(telemetry, "normalize", width * height):
+            noise_map = normalize_map(shared.copy())
+        del shared
+    finally:
+        shm.close()
+        shm.unlink()
+
+    return noise_map
+
+
+def progressive_noise(width, height, scale=100.0, octaves=6, persistence=0.5, lacunarity=2.0, seed=0,
+                      steps=(16, 4, 1), cancel=None):
+    """Yield (step, noise_map) previews sampling every step-th pixel, coarse to fine.
+
+    Only the sampled sub-grid of each level is kept, and points a coarser
+    level already computed are reused when its step is a multiple of the
+    next one. The step 1 level equals generate_noise_map. Every preview is
+    normalized by its own min/max.
+    """
+    x, y = noise_coords(width, height, scale)
+
+    prev_step = prev = None
+    for step in steps:
+        rows = y[::step].astype(np.float32)
+        cols = x[::step].astype(np.float32)
+        raw = np.empty((len(rows), len(cols)), dtype=np.float32)
+        known = np.zeros(raw.shape, dtype=bool)
+        if prev is not None and prev_step % step == 0:
+            ratio = prev_step // step
+            raw[::ratio, ::ratio] = prev
+            known[::ratio, ::ratio] = True
+
+        r, c = np.nonzero(~known)
+        for start in range(0, len(r), BLOCK_PIXELS):
+            check_cancel(cancel)
+            rr = r[start:start + BLOCK_PIXELS]
+            cc = c[start:start + BLOCK_PIXELS]
+            raw[rr, cc] = fbm2(rows[rr], cols[cc],
+                               octaves=octaves,
+                               persistence=persistence,
+                               lacunarity=lacunarity,
+                               base=seed / SEED_DIVISOR)
+
+        yield step, normalize_map(raw.astype(np.float64))
+        prev_step, prev = step, raw
+
+
 def pixelate_map(noise_map, pixelation_levels):
     noise_normalized = (noise_map - noise_map.min()) / (noise_map.max() - noise_map.min())
     noise_quantized = np.floor(noise_normalized * pixelation_levels) / pixelation_levels
@@ -56,6 +1002,30 @@ def scale_image(image, final_width, final_height):
     return image.resize((final_width, final_height), resample=PIL.Image.NEAREST)
 
 
+def clamp_block(width, height, block):
+    """Largest block size up to block that still samples at least 2x2 values.
+
+    A single sample cannot be normalized and has no slope.
+    """
+    return max(1, min(block, width - 1, height - 1))
+
+
+def pixelated_size(width, height, block):
+    """Size of the map sampled once per block x block pixels."""
+    return -(-width // block), -(-height // block)
+
+
+def upscale_blocks(array, block, width, height):
+    """Blow up a (h, w[, 3]) array into block x block pixels, cropped to (width, height)."""
+    if array.dtype != np.uint8:
+        # Heightmaps, array_to_image only takes uint8
+        return np.repeat(np.repeat(array, block, axis=0)[:height], block, axis=1)[:, :width]
+
+    h, w = array.shape[:2]
+    image = scale_image(array_to_image(array), w * block, h * block)
+    return np.ascontiguousarray(np.array(image)[:height, :width])
+
+
 def noise_color(value: int, variation: int, terrains: list[dict]) -> tuple:
     prev_level = 0
     
@@ -64,7 +1034,7 @@ def noise_color(value: int, variation: int, terrains: list[dict]) -> tuple:
         
         if value < level:
             base_color = t["base"]
-            variation_count = max(1, variation)
+            variation_count = max(1, t.get("variation", variation))
             
             band_size = level - prev_level
             
@@ -82,6 +1052,21 @@ def noise_color(value: int, variation: int, terrains: list[dict]) -> tuple:
 
     return (255, 255, 255)
 
+def palette_lut(variation: int, terrains: list[dict]) -> np.ndarray:
+    """256x3 uint8 table with the noise_color result for every quantized value."""
+    return np.array([noise_color(value, variation, terrains) for value in range(256)], dtype=np.uint8)
+
+
+def quantize_map(noise_map):
+    """Normalized noise map to the 0-255 integer levels used for coloring."""
+    return (noise_map * 255).astype(np.uint8)
+
+
+def colorize(noise_map, variation: int, terrains: list[dict]) -> np.ndarray:
+    """RGB (h, w, 3) uint8 array of the whole map through the palette table."""
+    return palette_lut(variation, terrains)[quantize_map(noise_map)]
+
+
 def change_brightness(rgb: tuple, brightness: float) -> tuple:
     rgb_adjusted = []
 
@@ -92,6 +1077,507 @@ def change_brightness(rgb: tuple, brightness: float) -> tuple:
     return tuple(rgb_adjusted)
 
 
+def surface_gradients(noise_map):
+    """(d/drow, d/dcolumn) float32 slopes of a noise map, see hillshade.
+
+    Heights are scaled by the map's longest side so slopes do not depend on
+    the map size. They only depend on the map, so they can be cached and
+    relit with any light and exaggeration. Axes shorter than 2 pixels have
+    no slope.
+    """
+    unit = np.float32(max(noise_map.shape))
+    heights = noise_map.astype(np.float32) * unit
+    return tuple(np.gradient(heights, axis=axis) if size > 1 else np.zeros_like(heights)
+                 for axis, size in enumerate(heights.shape))
+
+
+def _light_vector(azimuth, altitude):
+    """Unit vector towards the sun in (row, column, up) image coordinates."""
+    azimuth = np.radians(azimuth)
+    altitude = np.radians(altitude)
+    return (np.float32(-np.cos(azimuth) * np.cos(altitude)),
+            np.float32(np.sin(azimuth) * np.cos(altitude)),
+            np.float32(np.sin(altitude)))
+
+
+def hillshade(gradients, azimuth=SUN_AZIMUTH, altitude=SUN_ALTITUDE, exaggeration=RELIEF_EXAGGERATION):
+    """Lambertian shade in [0, 1] of the surface_gradients of a map.
+
+    azimuth is measured clockwise from the top of the map. exaggeration is
+    the height of the [0, 1] noise range relative to the map's longest side.
+    """
+    grad_row, grad_col = gradients
+    light_row, light_col, light_up = _light_vector(azimuth, altitude)
+    exaggeration = np.float32(exaggeration)
+
+    # Normal (-e*gx, -e*gy, 1) dotted with the light, then normalized
+    shade = light_up - (grad_row * light_row + grad_col * light_col) * exaggeration
+    shade /= np.sqrt(np.float32(1) + (grad_row * grad_row + grad_col * grad_col) * (exaggeration * exaggeration))
+    return np.clip(shade, 0, 1, out=shade)
+
+
+def shade_colors(colors, shade, strength=SHADE_STRENGTH, altitude=SUN_ALTITUDE):
+    """Blend a hillshade into (h, w, 3) uint8 colors, returns a new array.
+
+    Shade is taken relative to flat ground lit from altitude, so flat areas
+    keep their palette color while slopes facing away from the sun darken
+    and slopes facing it brighten. Done in row bands of BLOCK_PIXELS.
+    """
+    flat = np.float32(np.sin(np.radians(altitude)))
+    strength = np.float32(strength)
+    out = np.empty_like(colors)
+    band = max(1, BLOCK_PIXELS // colors.shape[1])
+    for row in range(0, colors.shape[0], band):
+        factor = np.float32(1) + strength * (shade[row:row + band] / flat - np.float32(1))
+        shaded = colors[row:row + band] * factor[:, :, None]
+        out[row:row + band] = np.clip(shaded, 0, 255)
+    return out
+
+
+def normal_map(gradients, exaggeration=RELIEF_EXAGGERATION):
+    """Tangent-space normal map of the surface_gradients as (h, w, 3) uint8.
+
+    Uses the OpenGL convention (green pointing to the top of the map), as
+    Blender and Godot expect.
+    """
+    grad_row, grad_col = gradients
+    exaggeration = np.float32(exaggeration)
+    normals = np.stack([-grad_col * exaggeration, grad_row * exaggeration,
+                        np.ones_like(grad_row)], axis=-1)
+    normals /= np.linalg.norm(normals, axis=-1, keepdims=True)
+    return ((normals + 1) * np.float32(127.5)).astype(np.uint8)
+
+
+class PNGStreamWriter:
+    """Write a PNG row band by row band, holding only one band in memory.
+
+    channels is 1 (grayscale) or 3 (RGB), rows are uint8 arrays of shape
+    (n, width) or (n, width, 3) written top to bottom.
+    """
+
+    def __init__(self, filename, width, height, channels=3, compress_level=6):
+        self.width = width
+        self.height = height
+        self.channels = channels
+        self.rows = 0
+        self.file = open(filename, "wb")
+        self.compressor = zlib.compressobj(compress_level)
+
+        color_type = 2 if channels == 3 else 0
+        self.file.write(b"\x89PNG\r\n\x1a\n")
+        self._chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, color_type, 0, 0, 0))
+
+    def write_rows(self, rows):
+        rows = np.asarray(rows, dtype=np.uint8).reshape(len(rows), self.width * self.channels)
+
+        # Every scanline starts with its filter type, 0 (none)
+        scanlines = np.zeros((len(rows), self.width * self.channels + 1), dtype=np.uint8)
+        scanlines[:, 1:] = rows
+        self.rows += len(rows)
+
+        data = self.compressor.compress(scanlines.tobytes())
+        if data:
+            self._chunk(b"IDAT", data)
+
+    def close(self):
+        if self.file.closed:
+            return
+        try:
+            if self.rows != self.height:
+                raise ValueError(f"PNG has {self.rows} of {self.height} rows")
+            self._chunk(b"IDAT", self.compressor.flush())
+            self._chunk(b"IEND", b"")
+        finally:
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.file.close()
+
+    def _chunk(self, kind, data):
+        _png_chunk(self.file, kind, data)
+
+
+def stream_map(width, height, output=None, noise_output=None, rgb_output=None, scale=100.0, octaves=6,
+               persistence=0.5, lacunarity=2.0, seed=0, variation=255, terrains=None, value_range=None,
+               raw_path=None, band_rows=None, compress_level=6, band_callback=None, cancel=None,
+               progress=None, backend=None):
+    """Generate, color and write a map in row bands, for maps larger than RAM.
+
+    output and noise_output are streamed PNGs of the colored and grayscale
+    map, rgb_output a raw (h, w, 3) uint8 .npy opened as a memory map. Peak
+    memory is a few bands rather than the whole map.
+
+    The map is normalized like generate_noise_map, with the min/max of a
+    first pass over every band. That pass recomputes the noise in the second
+    one unless raw_path names a float32 .npy file to spill it to. A known
+    value_range (min, max) skips the first pass; values are clipped to it.
+    band_callback, if given, is called with (row_start, row_end, colors) for
+    every colored band, and progress(rows, total) after every band of both
+    passes. backend is resolved like in generate_noise_map. Returns the
+    (min, max) range used.
+    """
+    if terrains is None:
+        terrains = DEFAULT_TERRAINS
+    if band_rows is None or band_rows <= 0:
+        band_rows = max(1, BLOCK_PIXELS // width)
+
+    x, y = noise_coords(width, height, scale)
+    params = dict(octaves=octaves, persistence=persistence, lacunarity=lacunarity, seed=seed,
+                  backend=resolve_backend(backend, width))
+    bands = [(row, min(height, row + band_rows)) for row in range(0, height, band_rows)]
+
+    raw = None
+    if raw_path is not None:
+        raw = np.lib.format.open_memmap(raw_path, mode="w+", dtype=np.float32, shape=(height, width))
+
+    passes = 2 if value_range is None else 1
+    done = 0
+    if value_range is None:
+        noise_min, noise_max = np.inf, -np.inf
+        for row, row_end in bands:
+            check_cancel(cancel)
+            band = noise_rows(x, y, row, row_end, **params)
+            noise_min = min(noise_min, float(band.min()))
+            noise_max = max(noise_max, float(band.max()))
+            if raw is not None:
+                raw[row:row_end] = band
+            done = row_end
+            if progress is not None:
+                progress(done, passes * height)
+    else:
+        noise_min, noise_max = value_range
+        raw = None
+
+    lut = palette_lut(variation, terrains)
+    writers = []
+    rgb = None
+    try:
+        if output is not None:
+            writers.append((PNGStreamWriter(output, width, height, 3, compress_level), True))
+        if noise_output is not None:
+            writers.append((PNGStreamWriter(noise_output, width, height, 1, compress_level), False))
+        if rgb_output is not None:
+            rgb = np.lib.format.open_memmap(rgb_output, mode="w+", dtype=np.uint8, shape=(height, width, 3))
+
+        for row, row_end in bands:
+            check_cancel(cancel)
+            band = raw[row:row_end] if raw is not None else noise_rows(x, y, row, row_end, **params)
+
+            # Same float64 arithmetic as normalize_map
+            band = normalize_range(band.astype(np.float64), (noise_min, noise_max))
+            levels = quantize_map(band)
+            colors = lut[levels]
+
+            for writer, colored in writers:
+                writer.write_rows(colors if colored else levels)
+            if rgb is not None:
+                rgb[row:row_end] = colors
+            if band_callback is not None:
+                band_callback(row, row_end, colors)
+            if progress is not None:
+                progress(done + row_end, passes * height)
+
+        for writer, _ in writers:
+            writer.close()
+    finally:
+        for writer, _ in writers:
+            writer.file.close()
+        if rgb is not None:
+            rgb.flush()
+            del rgb
+
+    return noise_min, noise_max
+
+
+def pyramid_levels(width, height, tile_size=256):
+    """Number of pyramid levels, halving the size until one tile holds the map."""
+    levels = 1
+    while max(width, height) > tile_size:
+        width, height = -(-width // 2), -(-height // 2)
+        levels += 1
+    return levels
+
+
+def downsample_shape(shape):
+    """Shape of downsample's result for an array of this shape."""
+    return (-(-shape[0] // 2), -(-shape[1] // 2)) + tuple(shape[2:])
+
+
+def downsample(array, band_rows=1024, out=None):
+    """Half size (h, w[, 3]) uint8 array by 2x2 box averaging, computed in bands.
+
+    out, e.g. a memory map of downsample_shape(array.shape), receives the
+    result instead of a new array.
+    """
+    height, width = array.shape[:2]
+    if out is None:
+        out = np.empty(downsample_shape(array.shape), dtype=np.uint8)
+
+    for row in range(0, height, band_rows * 2):
+        band = np.asarray(array[row:row + band_rows * 2], dtype=np.uint16)
+        # Odd edges repeat their last row/column
+        pad = [(0, band.shape[0] % 2), (0, width % 2)] + [(0, 0)] * (band.ndim - 2)
+        band = np.pad(band, pad, mode="edge")
+        band = band[0::2, 0::2] + band[1::2, 0::2] + band[0::2, 1::2] + band[1::2, 1::2]
+        out[row // 2:row // 2 + len(band)] = (band + 2) // 4
+
+    return out
+
+
+def _save_tile(array, path, compress_level):
+    Image.fromarray(np.ascontiguousarray(array)).save(path, compress_level=compress_level)
+
+
+def export_pyramid(array, directory, tile_size=256, workers=None, compress_level=1, cancel=None,
+                   progress=None):
+    """Write a mipmap tile pyramid of a (h, w[, 3]) uint8 map.
+
+    Level 0 is the full resolution and every level halves the previous one
+    until a single tile is left. Tiles are written as
+    directory/<level>/<column>_<row>.png by a thread pool, and the layout
+    is described in directory/pyramid.json. array may be a memory map, its
+    lower levels are then memory-mapped too (in temporary .npy files in
+    directory) so memory stays at a few bands. progress(tiles, total) is
+    called as tiles are written.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    height, width = array.shape[:2]
+    levels = pyramid_levels(width, height, tile_size)
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    # Tiles of every level, for progress
+    level_tiles = []
+    level_w, level_h = width, height
+    for _ in range(levels):
+        level_tiles.append(-(-level_w // tile_size) * -(-level_h // tile_size))
+        level_w, level_h = -(-level_w // 2), -(-level_h // 2)
+    total = sum(level_tiles)
+    # Lower levels of a memory-mapped map are memory-mapped as well
+    spill = isinstance(array, np.memmap)
+    spilled = []
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for level in range(levels):
+                level_dir = os.path.join(directory, str(level))
+                os.makedirs(level_dir, exist_ok=True)
+
+                level_h, level_w = array.shape[:2]
+                tasks = [
+                    pool.submit(_save_tile, array[top:top + tile_size, left:left + tile_size],
+                                os.path.join(level_dir, f"{left // tile_size}_{top // tile_size}.png"),
+                                compress_level)
+                    for top in range(0, level_h, tile_size)
+                    for left in range(0, level_w, tile_size)
+                ]
+                level_progress = None
+                if progress is not None:
+                    written = sum(level_tiles[:level])
+                    level_progress = lambda done, _, written=written: progress(written + done, total)
+                _wait_tasks(tasks, cancel, level_progress)
+
+                if level < levels - 1:
+                    out = None
+                    if spill:
+                        spilled.append(os.path.join(directory, f".level{level + 1}.npy"))
+                        out = np.lib.format.open_memmap(spilled[-1], mode="w+", dtype=np.uint8,
+                                                        shape=downsample_shape(array.shape))
+                    array = downsample(array, out=out)
+    finally:
+        # Unmapped before their files are removed
+        array = tasks = out = None
+        for path in spilled:
+            os.remove(path)
+
+    info = {"width": width, "height": height, "tile_size": tile_size, "levels": levels}
+    with open(os.path.join(directory, "pyramid.json"), "w") as f:
+        json.dump(info, f)
+
+    return info
+
+
+def video_size(width, height, target_width=1080):
+    """Video frame size (width, height) for a map, its longest side scaled towards target_width.
+
+    Whole factors are used when upscaling so pixels stay square blocks.
+    Sides are at least 1 pixel, however thin the map.
+    """
+    times_bigger = target_width / max(width, height)
+
+    if times_bigger >= 1:
+        times_bigger = round(times_bigger)
+    else:
+        # Maps over 20 times the target would round down to 0
+        times_bigger = round(times_bigger, 1) or times_bigger
+
+    return max(1, int(width * times_bigger)), max(1, int(height * times_bigger))
+
+
+def _nearest_index(src_size, dst_size):
+    """Source index sampled by every destination index for a nearest resize."""
+    index = ((np.arange(dst_size) + 0.5) * src_size / dst_size).astype(np.intp)
+    return np.minimum(index, src_size - 1)
+
+
+def reveal_frames(images, frame_count, size, cancel=None):
+    """Yield frames drawing the images pixel by pixel in raster order.
+
+    images are (h, w) or (h, w, 3) uint8 arrays of the same shape, revealed
+    one after another onto a shared canvas. frame_count frames are produced,
+    each advancing the reveal by an equal share of the pixels, at size
+    (width, height). Every image is resized once up front and each frame only
+    copies the newly revealed pixels, so the cost is linear in the output.
+    The same canvas array is yielded every time; copy it to keep a frame.
+    """
+    height, width = images[0].shape[:2]
+    frame_w, frame_h = size
+
+    row_index = _nearest_index(height, frame_h)
+    col_index = _nearest_index(width, frame_w)
+
+    scaled = []
+    for image in images:
+        if image.ndim == 2:
+            image = np.repeat(image[:, :, None], 3, axis=2)
+        scaled.append(image[row_index][:, col_index])
+
+    canvas = np.zeros((frame_h, frame_w, 3), dtype=np.uint8)
+    pixels = width * height
+    total = pixels * len(images)
+    frame_count = max(1, min(frame_count, total))
+
+    done = 0
+    for frame in range(1, frame_count + 1):
+        check_cancel(cancel)
+        target = total * frame // frame_count
+        while done < target:
+            image = scaled[done // pixels]
+            start = done % pixels
+            end = min(pixels, start + target - done)
+            _reveal(canvas, image, row_index, col_index, width, start, end)
+            done += end - start
+        yield canvas
+
+
+def _reveal(canvas, image, row_index, col_index, width, start, end):
+    """Copy source pixels [start, end) of a row-major map from the scaled image."""
+    first_row, first_col = divmod(start, width)
+    last_row, last_col = divmod(end, width)
+
+    if first_row == last_row:
+        _reveal_row(canvas, image, row_index, col_index, first_row, first_col, last_col)
+        return
+
+    _reveal_row(canvas, image, row_index, col_index, first_row, first_col, width)
+
+    # Whole rows in between
+    top = np.searchsorted(row_index, first_row + 1)
+    bottom = np.searchsorted(row_index, last_row)
+    canvas[top:bottom] = image[top:bottom]
+
+    if last_col:
+        _reveal_row(canvas, image, row_index, col_index, last_row, 0, last_col)
+
+
+def _reveal_row(canvas, image, row_index, col_index, row, col_start, col_end):
+    top = np.searchsorted(row_index, row)
+    bottom = np.searchsorted(row_index, row + 1)
+    left = np.searchsorted(col_index, col_start)
+    right = np.searchsorted(col_index, col_end)
+    canvas[top:bottom, left:right] = image[top:bottom, left:right]
+
+
+class VideoEncoder:
+    """Encode video frames on a background thread.
+
+    Frames go through a bounded queue, so append blocks while the encoder is
+    queue_size frames behind and memory stays bounded however many frames are
+    produced. progress, if given, is called from the encoder thread with the
+    number of frames encoded so far and the encode throughput in frames/s.
+    """
+
+    def __init__(self, filename, fps, queue_size=32, progress=None):
+        self.filename = filename
+        self.fps = fps
+        self.progress = progress
+        self.frames = 0
+        self.encode_time = 0.0
+        self.error = None
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.writer = None
+
+    def start(self):
+        import imageio
+
+        self.writer = imageio.get_writer(self.filename, fps=self.fps)
+        self.thread.start()
+        return self
+
+    def append(self, frame):
+        """Queue a copy of frame, waiting while the queue is full."""
+        if self.error is not None:
+            raise self.error
+        self.queue.put(np.array(frame, copy=True))
+
+    def close(self, discard=False):
+        """Flush the queued frames and finish the file.
+
+        With discard the frames still queued are dropped instead. An encoding
+        error is raised by the first call only, so cleanup code can close
+        again safely.
+        """
+        if discard:
+            while True:
+                try:
+                    self.queue.get_nowait()
+                except queue.Empty:
+                    break
+
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+        if self.writer is not None:
+            writer, self.writer = self.writer, None
+            writer.close()
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    @property
+    def frames_per_second(self):
+        return self.frames / self.encode_time if self.encode_time > 0 else 0.0
+
+    def _run(self):
+        while True:
+            frame = self.queue.get()
+            if frame is None:
+                return
+            if self.error is not None:
+                continue
+
+            start = time.perf_counter()
+            try:
+                self.writer.append_data(frame)
+            except Exception as e:
+                # Keep draining so producers blocked on put() are released
+                self.error = e
+                continue
+            self.encode_time += time.perf_counter() - start
+            self.frames += 1
+
+            if self.progress is not None:
+                self.progress(self.frames, self.frames_per_second)
+
+
 def percent(a, b)->float:
     return (a / b) * 100
 
@@ -0,0 +1,73 @@
+"""Numba port of lib.fbm2, one pixel at a time without temporaries.
+
+Only imported by the "numba" noise backend, when numba is installed. Every
+value is kept in float32 in the same operation order as lib.simplex2, so
+the output matches the NumPy kernel and noise.snoise2 bit for bit.
+"""
+import numpy as np
+from numba import njit
+
+F2 = np.float32(0.3660254037844386)  # 0.5 * (sqrt(3.0) - 1.0)
+G2 = np.float32(0.21132486540518713)  # (3.0 - sqrt(3.0)) / 6.0
+
+
+@njit(cache=True, nogil=True)
+def _corner(xx, yy, gx, gy):
+    f = np.float32(0.5) - xx * xx - yy * yy
+    if f > np.float32(0.0):
+        return f * f * f * f * (gx * xx + gy * yy)
+    return np.float32(0.0)
+
+
+@njit(cache=True, nogil=True)
+def simplex2(x, y, perm, grad):
+    s = (x + y) * F2
+    i = np.float32(np.floor(x + s))
+    j = np.float32(np.floor(y + s))
+    t = (i + j) * G2
+
+    xx0 = x - (i - t)
+    yy0 = y - (j - t)
+
+    if xx0 > yy0:
+        i1, j1 = 1, 0
+    else:
+        i1, j1 = 0, 1
+
+    xx1 = xx0 - np.float32(i1) + G2
+    yy1 = yy0 - np.float32(j1) + G2
+    xx2 = xx0 + G2 * np.float32(2.0) - np.float32(1.0)
+    yy2 = yy0 + G2 * np.float32(2.0) - np.float32(1.0)
+
+    ii = np.int32(i) & 255
+    jj = np.int32(j) & 255
+    g0 = perm[ii + perm[jj]] % 12
+    g1 = perm[ii + i1 + perm[jj + j1]] % 12
+    g2 = perm[ii + 1 + perm[jj + 1]] % 12
+
+    total = _corner(xx0, yy0, grad[g0, 0], grad[g0, 1])
+    total += _corner(xx1, yy1, grad[g1, 0], grad[g1, 1])
+    total += _corner(xx2, yy2, grad[g2, 0], grad[g2, 1])
+    return total * np.float32(70.0)
+
+
+@njit(cache=True, nogil=True)
+def fbm2_grid(rows, cols, octaves, persistence, lacunarity, base, perm, grad, out):
+    """out[r, c] = fbm2(rows[r], cols[c]), all float32."""
+    for r in range(rows.shape[0]):
+        for c in range(cols.shape[0]):
+            x = rows[r]
+            y = cols[c]
+
+            freq = np.float32(1.0)
+            amp = np.float32(1.0)
+            max_amp = np.float32(1.0)
+            total = simplex2(x + base, y + base, perm, grad)
+
+            for _ in range(1, octaves):
+                freq *= lacunarity
+                amp *= persistence
+                max_amp += amp
+                total += simplex2(x * freq + base, y * freq + base, perm, grad) * amp
+
+            out[r, c] = total / max_amp
@@ -0,0 +1,149 @@
+"""Per-stage timing of the generation pipeline.
+
+Wrap each stage in Telemetry.stage to record its wall time, CPU time,
+throughput and memory high-water mark. The records can be shown as a text
+table or dumped as JSON and Chrome trace format (chrome://tracing,
+https://ui.perfetto.dev). With profile=True every outermost stage also runs
+under cProfile, covering the stages nested in it, and its stats can be
+saved for snakeviz/pstats.
+
+CPU time is the whole process's, so stages overlapping on other threads
+(PNG writing during video frames) count each other's work.
+"""
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+
+def peak_rss_mb():
+    """Peak resident memory of this process so far, None where unsupported."""
+    try:
+        import resource
+    except ImportError:
+        return None
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kB on Linux, bytes on macOS
+    return peak / (1 << 20) if sys.platform == "darwin" else peak / 1024
+
+
+class Telemetry:
+    """Records of the stages of one run, safe to use from several threads."""
+
+    def __init__(self, profile=False):
+        self.profile = profile
+        self.stages = []
+        self.profiles = {}
+        self.origin = time.perf_counter()
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    @contextmanager
+    def stage(self, name, pixels=None):
+        """Time the body as stage name; pixels gives the pixels/s figure."""
+        depth = getattr(self.local, "depth", 0)
+        self.local.depth = depth + 1
+
+        # Enabling a profiler replaces the active one on Python < 3.12 and
+        # fails on 3.12+, so nested stages are left to the outermost one
+        profiler = None
+        if self.profile and depth == 0:
+            import cProfile
+
+            profiler = cProfile.Profile()
+
+        rss_before = peak_rss_mb()
+        cpu_start = time.process_time()
+        start = time.perf_counter()
+        if profiler is not None:
+            try:
+                profiler.enable()
+            except ValueError:
+                # Python 3.12+ allows one active profiler across threads
+                profiler = None
+        try:
+            yield
+        finally:
+            if profiler is not None:
+                profiler.disable()
+            end = time.perf_counter()
+            cpu = time.process_time() - cpu_start
+            self.local.depth = depth
+
+            rss = peak_rss_mb()
+            self.add(name, end - start, start=start, cpu=cpu, pixels=pixels, depth=depth,
+                     peak_rss_mb=rss, rss_growth_mb=None if rss is None else rss - rss_before)
+            if profiler is not None:
+                with self.lock:
+                    self.profiles[name] = profiler
+
+    def add(self, name, wall, start=None, cpu=None, pixels=None, depth=0, peak_rss_mb=None, rss_growth_mb=None):
+        """Record a stage measured elsewhere, e.g. on an encoder thread."""
+        if start is None:
+            start = time.perf_counter() - wall
+
+        record = {
+            "name": name,
+            "start": start - self.origin,
+            "wall": wall,
+            "cpu": cpu,
+            "pixels": pixels,
+            "pixels_per_second": pixels / wall if pixels and wall > 0 else None,
+            "peak_rss_mb": peak_rss_mb,
+            "rss_growth_mb": rss_growth_mb,
+            "depth": depth,
+            "thread": threading.current_thread().name,
+            "tid": threading.get_ident(),
+        }
+        with self.lock:
+            self.stages.append(record)
+
+    def summary(self):
+        with self.lock:
+            return sorted(self.stages, key=lambda s: s["start"])
+
+    def format_table(self):
+        lines = []
+        for s in self.summary():
+            name = "  " * s["depth"] + s["name"]
+            line = f"{name:<18} {s['wall'] * 1000:9.1f} ms"
+            if s["cpu"] is not None:
+                line += f"  cpu {s['cpu'] * 1000:9.1f} ms"
+            if s["pixels_per_second"] is not None:
+                line += f"  {s['pixels_per_second'] / 1e6:8.1f} MP/s"
+            if s["peak_rss_mb"] is not None:
+                line += f"  rss {s['peak_rss_mb']:7.0f} MB"
+            lines.append(line)
+        return "\n".join(lines)
+
+    def save_json(self, path):
+        with open(path, "w") as f:
+            json.dump({"stages": self.summary()}, f, indent=2)
+
+    def save_chrome_trace(self, path):
+        pid = os.getpid()
+        events = [
+            {
+                "name": s["name"],
+                "ph": "X",
+                "ts": s["start"] * 1e6,
+                "dur": s["wall"] * 1e6,
+                "pid": pid,
+                "tid": s["tid"],
+                "args": {k: s[k] for k in ("cpu", "pixels", "pixels_per_second", "peak_rss_mb", "rss_growth_mb")},
+            }
+            for s in self.summary()
+        ]
+        with open(path, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+    def save_profiles(self, directory):
+        """Write the cProfile stats of every stage as <directory>/<stage>.prof."""
+        os.makedirs(directory, exist_ok=True)
+        with self.lock:
+            profiles = dict(self.profiles)
+        for name, profiler in profiles.items():
+            profiler.dump_stats(os.path.join(directory, f"{name}.prof"))
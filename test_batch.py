@@ -0,0 +1,17 @@
+"""Tests of batch, run with `python -m pytest`."""
+import pytest
+
+import batch
+
+
+def test_output_paths_per_seed():
+    jobs = batch.seed_jobs([1, 2, 30], 64, 32)
+
+    assert batch.output_paths(jobs, "map_{seed}.png") == ["map_1.png", "map_2.png", "map_30.png"]
+    assert batch.output_paths(jobs[:1], "output.png") == ["output.png"]
+
+
+@pytest.mark.parametrize("output", ["output.png", "map_{width}x{height}.png"])
+def test_output_paths_must_differ(output):
+    with pytest.raises(ValueError):
+        batch.output_paths(batch.seed_jobs([1, 2], 64, 32), output)
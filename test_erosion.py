@@ -0,0 +1,38 @@
+"""Tests of erosion, run with `python -m pytest`."""
+import numpy as np
+import pytest
+
+import erosion
+import lib
+
+
+@pytest.fixture(scope="module")
+def noise_map():
+    return lib.generate_noise_map(64, 48, scale=1.75, octaves=5, seed=4, backend="numpy")
+
+
+@pytest.mark.parametrize("thermal, hydraulic", [(True, True), (True, False), (False, True)])
+def test_bands_match_single_process(noise_map, thermal, hydraulic):
+    # Iterations that do not divide into sync_iterations leave a short last round
+    params = dict(iterations=19, thermal=thermal, hydraulic=hydraulic, sync_iterations=8)
+    expected = erosion.erode(noise_map, workers=1, **params)
+
+    eroded = erosion.erode(noise_map, workers=2, band_rows=7, **params)
+
+    np.testing.assert_array_equal(eroded, expected)
+
+
+def test_thermal_step_conserves_mass(noise_map):
+    height = noise_map.astype(np.float32) * np.float32(64)
+
+    for _ in range(20):
+        eroded = erosion.thermal_step(height)
+        assert eroded.sum(dtype=np.float64) == pytest.approx(height.sum(dtype=np.float64), rel=1e-6)
+        height = eroded
+
+
+def test_thermal_erosion_conserves_mass(noise_map):
+    eroded = erosion.erode(noise_map, iterations=30, hydraulic=False)
+
+    assert not np.array_equal(eroded, noise_map)
+    assert eroded.sum(dtype=np.float64) == pytest.approx(noise_map.sum(dtype=np.float64), rel=1e-5)
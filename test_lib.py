@@ -0,0 +1,200 @@
+"""Tests of lib, run with `python -m pytest`."""
+import struct
+import zlib
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import lib
+
+noise = pytest.importorskip("noise")
+
+
+def snoise_rows(width, height, scale, octaves, persistence, lacunarity, seed):
+    """Raw noise of the whole map, one noise.snoise2 call per pixel."""
+    x, y = lib.noise_coords(width, height, scale)
+    base = seed / lib.SEED_DIVISOR
+    return np.array([[noise.snoise2(float(row), float(col), octaves=octaves, persistence=persistence,
+                                    lacunarity=lacunarity, base=base)
+                      for col in x.astype(np.float32)]
+                     for row in y.astype(np.float32)], dtype=np.float32)
+
+
+@pytest.mark.parametrize("width, height, scale, octaves, persistence, lacunarity, seed", [
+    (64, 64, 1.75, 1, 0.5, 2.0, 0),
+    (97, 31, 1.75, 8, 0.5, 2.0, 42),
+    (40, 120, 25.0, 5, 0.37, 2.3, 12345),
+    (128, 16, 500.0, 3, 0.8, 1.7, 7),
+])
+def test_fbm_matches_snoise2(width, height, scale, octaves, persistence, lacunarity, seed):
+    x, y = lib.noise_coords(width, height, scale)
+    raw = lib.noise_rows(x, y, 0, height, octaves=octaves, persistence=persistence,
+                         lacunarity=lacunarity, seed=seed)
+
+    expected = snoise_rows(width, height, scale, octaves, persistence, lacunarity, seed)
+    assert raw.dtype == np.float32
+    np.testing.assert_array_equal(raw, expected)
+
+
+def test_noise_map_matches_snoise2():
+    expected = lib.normalize_map(snoise_rows(96, 80, 1.75, 6, 0.5, 2.0, 3).astype(np.float64))
+    nmap = lib.generate_noise_map(96, 80, scale=1.75, octaves=6, seed=3, backend="numpy")
+
+    np.testing.assert_array_equal(nmap, expected)
+
+
+OVERRIDE_TERRAINS = [
+    {"name": "Sea", "level": 90, "base": [30, 45, 60], "variation": 3},
+    {"name": "Beach", "level": 100, "base": [200, 190, 120]},
+    {"name": "Hills", "level": 170, "base": [60, 120, 50], "variation": 1},
+    {"name": "Rock", "level": 230, "base": [110, 110, 110], "variation": 40},
+]
+
+
+@pytest.mark.parametrize("value, variation, color", [
+    # Sea overrides variation with 3 steps: 0.8, 0.933 and 1.067 brightness
+    (0, 7, (24, 36, 48)),
+    (50, 7, (28, 42, 56)),
+    (89, 255, (32, 48, 64)),
+    # Beach follows the global variation
+    (90, 7, (160, 152, 96)),
+    (95, 7, (194, 184, 116)),
+    (95, 255, (199, 189, 119)),
+    # Hills has a single step
+    (100, 255, (48, 96, 40)),
+    (169, 255, (48, 96, 40)),
+    (200, 7, (110, 110, 110)),
+    # White above the last level
+    (230, 7, (255, 255, 255)),
+    (255, 255, (255, 255, 255)),
+])
+def test_palette_colors(value, variation, color):
+    lut = lib.palette_lut(variation, OVERRIDE_TERRAINS)
+
+    assert tuple(lut[value]) == color
+    assert lib.noise_color(value, variation, OVERRIDE_TERRAINS) == color
+
+
+@pytest.mark.parametrize("terrains", [lib.DEFAULT_TERRAINS, OVERRIDE_TERRAINS], ids=["default", "overrides"])
+def test_colorize_matches_noise_color(terrains):
+    # Every level once plus random heights
+    nmap = np.concatenate([np.arange(256) / 255, np.random.default_rng(0).random(256 * 15)]).reshape(64, 64)
+    colors = lib.colorize(nmap, variation=255, terrains=terrains)
+
+    expected = [[lib.noise_color(int(value * 255), 255, terrains) for value in row] for row in nmap]
+    np.testing.assert_array_equal(colors, np.array(expected, dtype=np.uint8))
+
+
+@pytest.mark.parametrize("shape", [(1, 1), (1, 5), (5, 1)])
+def test_surface_gradients_of_thin_maps(shape):
+    grad_row, grad_col = lib.surface_gradients(np.linspace(0, 1, np.prod(shape)).reshape(shape))
+
+    assert grad_row.shape == grad_col.shape == shape
+    assert not grad_row.any() if shape[0] == 1 else grad_row.all()
+    assert not grad_col.any() if shape[1] == 1 else grad_col.all()
+
+
+@pytest.mark.parametrize("width, height, block", [(200, 40, 64), (64, 64, 64), (2, 300, 8), (500, 400, 16)])
+def test_clamped_block_samples_2x2(width, height, block):
+    block = lib.clamp_block(width, height, block)
+    noise_w, noise_h = lib.pixelated_size(width, height, block)
+
+    assert noise_w >= 2 and noise_h >= 2
+    nmap = lib.generate_noise_map(noise_w, noise_h, scale=1.75, seed=1, backend="numpy")
+    assert nmap.min() == 0 and nmap.max() == 1
+
+
+class FailingWriter:
+    def append_data(self, frame):
+        raise OSError("disk full")
+
+    def close(self):
+        pass
+
+
+def test_video_encoder_raises_error_once():
+    encoder = lib.VideoEncoder("unused.mp4", 30)
+    encoder.writer = FailingWriter()
+    encoder.thread.start()
+    encoder.append(np.zeros((4, 4, 3), dtype=np.uint8))
+
+    with pytest.raises(OSError):
+        encoder.close()
+    encoder.close(discard=True)
+
+
+@pytest.mark.parametrize("width, height", [(512, 512), (1000, 300), (22000, 100), (32768, 2048),
+                                           (100, 22000), (2048, 32768), (3, 40000)])
+def test_video_size_of_wide_and_tall_maps(width, height):
+    video_w, video_h = lib.video_size(width, height)
+
+    assert 1 <= video_w <= 1100 and 1 <= video_h <= 1100
+    assert max(video_w, video_h) >= 1000
+
+
+def test_pyramid_of_memory_map_matches(tmp_path):
+    colors = np.random.default_rng(0).integers(0, 256, (300, 700, 3), dtype=np.uint8)
+    np.save(tmp_path / "colors.npy", colors)
+
+    lib.export_pyramid(colors, tmp_path / "memory", tile_size=64)
+    lib.export_pyramid(np.load(tmp_path / "colors.npy", mmap_mode="r"), tmp_path / "mapped", tile_size=64)
+
+    tiles = sorted(path.relative_to(tmp_path / "memory") for path in (tmp_path / "memory").rglob("*"))
+    assert tiles == sorted(path.relative_to(tmp_path / "mapped") for path in (tmp_path / "mapped").rglob("*"))
+    for tile in tiles:
+        if tile.suffix == ".png":
+            assert (tmp_path / "memory" / tile).read_bytes() == (tmp_path / "mapped" / tile).read_bytes()
+
+
+def png_idat(path):
+    """Joined IDAT chunk data of a PNG file."""
+    data = path.read_bytes()
+    offset, idat = 8, b""
+    while offset < len(data):
+        length, kind = struct.unpack(">I4s", data[offset:offset + 8])
+        if kind == b"IDAT":
+            idat += data[offset + 8:offset + 8 + length]
+        offset += 12 + length
+    return idat
+
+
+@pytest.mark.parametrize("shape, dtype", [((37, 53, 3), np.uint8), ((61, 17), np.uint8), ((1, 1, 3), np.uint8),
+                                          ((1, 1), np.uint8), ((45, 29), np.float32)])
+@pytest.mark.parametrize("compress_level", [0, 6])
+def test_png_round_trip(tmp_path, monkeypatch, shape, dtype, compress_level):
+    # Bands of a few rows, so most images are joined from several streams
+    monkeypatch.setattr(lib, "PNG_BAND_BYTES", 100)
+    rng = np.random.default_rng(0)
+    if dtype == np.uint8:
+        array = rng.integers(0, 256, shape, dtype=np.uint8)
+        expected = array
+    else:
+        array = rng.random(shape, dtype=dtype)
+        expected = (array * 65535).astype(np.uint16)
+    path = tmp_path / "map.png"
+
+    lib.save_outputs([(array, str(path))], compress_level=compress_level, workers=3)
+
+    with Image.open(path) as image:
+        np.testing.assert_array_equal(np.array(image), expected)
+    # zlib.decompress checks the combined Adler-32
+    row_bytes = expected[0].nbytes
+    assert len(zlib.decompress(png_idat(path))) == shape[0] * (row_bytes + 1)
+
+
+@pytest.mark.parametrize("spill", [False, True], ids=["recompute", "raw_path"])
+def test_stream_map_matches_in_memory(tmp_path, spill):
+    params = dict(scale=1.75, octaves=5, seed=9)
+    nmap = lib.generate_noise_map(150, 70, backend="numpy", **params)
+
+    lib.stream_map(150, 70, output=str(tmp_path / "output.png"), noise_output=str(tmp_path / "noise.png"),
+                   rgb_output=str(tmp_path / "rgb.npy"), raw_path=str(tmp_path / "raw.npy") if spill else None,
+                   band_rows=16, backend="numpy", **params)
+
+    colors = lib.colorize(nmap, variation=255, terrains=lib.DEFAULT_TERRAINS)
+    with Image.open(tmp_path / "output.png") as image:
+        np.testing.assert_array_equal(np.array(image), colors)
+    with Image.open(tmp_path / "noise.png") as image:
+        np.testing.assert_array_equal(np.array(image), lib.quantize_map(nmap))
+    np.testing.assert_array_equal(np.load(tmp_path / "rgb.npy"), colors)
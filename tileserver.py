@@ -0,0 +1,133 @@
+"""Serve colored world chunks over HTTP on localhost.
+
+Chunks are windows of an infinite world rendered with lib.generate_region,
+so neighbouring chunks line up. Example:
+
+    python tileserver.py --seed 42 --chunk-size 256 --port 8000
+    curl http://127.0.0.1:8000/chunk/-3/7.png > chunk.png
+
+GET /chunk/<cx>/<cy>.png   colored chunk
+GET /noise/<cx>/<cy>.png   grayscale chunk
+GET /stats                 chunk cache counters as JSON
+"""
+import argparse
+import io
+import ipaddress
+import json
+import re
+import sys
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import cache
+import lib
+
+CHUNK_PATH = re.compile(r"^/(chunk|noise)/(-?\d+)/(-?\d+)\.png$")
+
+
+class ChunkRenderer:
+    """Renders and caches the PNG of every chunk of one world."""
+
+    def __init__(self, chunk_size=256, pixel_size=lib.WORLD_PIXEL_SIZE, octaves=8, persistence=0.5,
+                 lacunarity=2.0, seed=0, value_range=lib.WORLD_VALUE_RANGE, variation=255, terrains=None,
+                 cache_bytes=256 << 20, compress_level=1):
+        self.chunk_size = chunk_size
+        self.params = dict(pixel_size=pixel_size, octaves=octaves, persistence=persistence,
+                           lacunarity=lacunarity, seed=seed, value_range=value_range)
+        self.lut = lib.palette_lut(variation, terrains or lib.DEFAULT_TERRAINS)
+        self.compress_level = compress_level
+        self.cache = cache.ChunkCache(cache_bytes)
+
+    def png(self, kind, cx, cy):
+        return self.cache.get_or_render((kind, cx, cy), lambda: self.render(kind, cx, cy))
+
+    def render(self, kind, cx, cy):
+        size = self.chunk_size
+        noise_map = lib.generate_region(cx * size, cy * size, size, size, **self.params)
+
+        levels = lib.quantize_map(noise_map)
+        array = self.lut[levels] if kind == "chunk" else levels
+
+        buffer = io.BytesIO()
+        lib.array_to_image(array).save(buffer, format="PNG", compress_level=self.compress_level)
+        return buffer.getvalue()
+
+
+class ChunkHandler(BaseHTTPRequestHandler):
+    renderer = None
+
+    def do_GET(self):
+        if self.path == "/stats":
+            self.send(200, "application/json", json.dumps(self.renderer.cache.stats()).encode())
+            return
+
+        match = CHUNK_PATH.match(self.path)
+        if match is None:
+            self.send(404, "text/plain", b"Not found\n")
+            return
+
+        kind, cx, cy = match.group(1), int(match.group(2)), int(match.group(3))
+        self.send(200, "image/png", self.renderer.png(kind, cx, cy))
+
+    def send(self, status, content_type, body):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(renderer, host="127.0.0.1", port=8000):
+    """Serve renderer's chunks until interrupted. Only loopback hosts are accepted."""
+    if not ipaddress.ip_address(host).is_loopback:
+        raise ValueError(f"Refusing to serve on non-loopback address {host}")
+
+    handler = type("Handler", (ChunkHandler,), {"renderer": renderer})
+    server = ThreadingHTTPServer((host, port), handler)
+    print(f"Serving chunks on http://{host}:{port}/chunk/<cx>/<cy>.png")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve terrain chunks on localhost.")
+    parser.add_argument("--host", default="127.0.0.1", help="Loopback address to bind")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--chunk-size", type=int, default=256)
+    parser.add_argument("--pixel-size", type=float, default=lib.WORLD_PIXEL_SIZE,
+                        help="Noise distance between two pixels")
+    parser.add_argument("--octaves", type=int, default=8)
+    parser.add_argument("--persistence", type=float, default=0.5)
+    parser.add_argument("--lacunarity", type=float, default=2.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--range", type=float, nargs=2, default=lib.WORLD_VALUE_RANGE, metavar=("MIN", "MAX"),
+                        help="Noise values mapped to black and white")
+    parser.add_argument("--variation", type=int, default=255)
+    parser.add_argument("--terrains", help="JSON file with a list of terrains")
+    parser.add_argument("--cache-mb", type=int, default=256)
+    args = parser.parse_args(argv)
+
+    renderer = ChunkRenderer(
+        chunk_size=args.chunk_size,
+        pixel_size=args.pixel_size,
+        octaves=args.octaves,
+        persistence=args.persistence,
+        lacunarity=args.lacunarity,
+        seed=args.seed,
+        value_range=tuple(args.range),
+        variation=args.variation,
+        terrains=lib.load_terrains(args.terrains),
+        cache_bytes=args.cache_mb << 20
+    )
+    serve(renderer, args.host, args.port)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,170 @@
+"""Pan and zoom view for maps, drawing tile pyramids a visible tile at a time."""
+import json
+import math
+import os
+from collections import OrderedDict
+
+from PyQt6.QtCore import QPointF, QRectF, Qt
+from PyQt6.QtGui import QColor, QPainter, QPixmap
+from PyQt6.QtWidgets import QWidget
+
+MIN_ZOOM = 1 / 256
+MAX_ZOOM = 64
+ZOOM_STEP = 1.25
+
+
+class TileViewer(QWidget):
+    """Shows one image or a pyramid written by lib.export_pyramid.
+
+    Both are placed in map coordinates (the full map size), so a coarse
+    preview and the final tiles line up. Pyramid tiles are loaded from disk
+    for the level matching the zoom, only where visible, and kept in an LRU
+    of cache_tiles pixmaps. Drag to pan, wheel to zoom, double click to fit.
+    """
+
+    def __init__(self, parent=None, cache_tiles=256):
+        super().__init__(parent)
+        self.cache_tiles = cache_tiles
+        self.tiles = OrderedDict()
+        self.pixmap = None
+        self.pyramid = None
+        self.pyramid_dir = None
+        self.map_size = None
+        self.zoom = 1.0
+        self.offset = QPointF(0, 0)  # map point at the widget's top left corner
+        self.drag_start = None
+        self.text = ""
+        self.setMouseTracking(False)
+
+    def setText(self, text):
+        self.text = text
+        self.update()
+
+    def set_image(self, qimage, map_size=None):
+        """Show qimage stretched over map_size (w, h), by default its own size."""
+        if map_size is None:
+            map_size = (qimage.width(), qimage.height())
+
+        self.pixmap = QPixmap.fromImage(qimage)
+        self.pyramid = None
+        self.tiles.clear()
+        self._set_map_size(map_size)
+        self.update()
+
+    def set_pyramid(self, directory):
+        """Switch to the tiles in directory, keeping the current view."""
+        with open(os.path.join(directory, "pyramid.json")) as f:
+            self.pyramid = json.load(f)
+        self.pyramid_dir = directory
+        self.tiles.clear()
+
+        # The tiles replace the full size image
+        self.pixmap = None
+        self._set_map_size((self.pyramid["width"], self.pyramid["height"]))
+        self.update()
+
+    def fit(self):
+        if self.map_size is None:
+            return
+        map_w, map_h = self.map_size
+        self.zoom = min(self.width() / map_w, self.height() / map_h)
+        self.offset = QPointF((map_w - self.width() / self.zoom) / 2, (map_h - self.height() / self.zoom) / 2)
+        self.update()
+
+    def _set_map_size(self, map_size):
+        if map_size != self.map_size:
+            self.map_size = map_size
+            self.fit()
+
+    def _tile(self, level, column, row):
+        key = (level, column, row)
+        if key in self.tiles:
+            self.tiles.move_to_end(key)
+            return self.tiles[key]
+
+        path = os.path.join(self.pyramid_dir, str(level), f"{column}_{row}.png")
+        pixmap = QPixmap(path) if os.path.exists(path) else None
+        if pixmap is not None and pixmap.isNull():
+            pixmap = None
+
+        # Missing tiles are not cached, they may still be being written
+        if pixmap is not None:
+            self.tiles[key] = pixmap
+            while len(self.tiles) > self.cache_tiles:
+                self.tiles.popitem(last=False)
+        return pixmap
+
+    def _view_rect(self, x, y, w, h):
+        """Widget rectangle of a map rectangle."""
+        return QRectF((x - self.offset.x()) * self.zoom, (y - self.offset.y()) * self.zoom,
+                      w * self.zoom, h * self.zoom)
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        painter.fillRect(self.rect(), QColor(0, 0, 0))
+
+        if self.map_size is None:
+            painter.setPen(QColor(200, 200, 200))
+            painter.drawText(self.rect(), Qt.AlignmentFlag.AlignCenter, self.text)
+            return
+
+        map_w, map_h = self.map_size
+        if self.pyramid is None:
+            if self.pixmap is not None:
+                painter.drawPixmap(self._view_rect(0, 0, map_w, map_h), self.pixmap,
+                                   QRectF(self.pixmap.rect()))
+            return
+
+        levels = self.pyramid["levels"]
+        level = min(levels - 1, max(0, int(math.floor(math.log2(1 / self.zoom)))))
+        tile_span = self.pyramid["tile_size"] * 2 ** level  # map pixels per tile
+
+        left = max(0, int(self.offset.x() // tile_span))
+        top = max(0, int(self.offset.y() // tile_span))
+        right = min(-(-map_w // tile_span), int((self.offset.x() + self.width() / self.zoom) // tile_span) + 1)
+        bottom = min(-(-map_h // tile_span), int((self.offset.y() + self.height() / self.zoom) // tile_span) + 1)
+
+        for row in range(top, bottom):
+            for column in range(left, right):
+                pixmap = self._tile(level, column, row)
+                if pixmap is None:
+                    continue
+                scale = 2 ** level
+                target = self._view_rect(column * tile_span, row * tile_span,
+                                         pixmap.width() * scale, pixmap.height() * scale)
+                painter.drawPixmap(target, pixmap, QRectF(pixmap.rect()))
+
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        self.fit()
+
+    def wheelEvent(self, event):
+        if self.map_size is None:
+            return
+
+        # Keep the map point under the cursor in place
+        cursor = event.position()
+        anchor = QPointF(self.offset.x() + cursor.x() / self.zoom, self.offset.y() + cursor.y() / self.zoom)
+
+        factor = ZOOM_STEP if event.angleDelta().y() > 0 else 1 / ZOOM_STEP
+        self.zoom = min(MAX_ZOOM, max(MIN_ZOOM, self.zoom * factor))
+        self.offset = QPointF(anchor.x() - cursor.x() / self.zoom, anchor.y() - cursor.y() / self.zoom)
+        self.update()
+
+    def mousePressEvent(self, event):
+        if event.button() == Qt.MouseButton.LeftButton:
+            self.drag_start = (event.position(), QPointF(self.offset))
+
+    def mouseMoveEvent(self, event):
+        if self.drag_start is None:
+            return
+        start, offset = self.drag_start
+        delta = event.position() - start
+        self.offset = QPointF(offset.x() - delta.x() / self.zoom, offset.y() - delta.y() / self.zoom)
+        self.update()
+
+    def mouseReleaseEvent(self, event):
+        self.drag_start = None
+
+    def mouseDoubleClickEvent(self, event):
+        self.fit()